@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+##############################################################################
+# Benchmark text_parser tokenization on synthetic Reddit-like comments.
+#
+# Compares the original str.translate() tokenizer against
+# text_parser.tokenize(), checks that both produce identical tokens, and
+# reports the end-to-end parse_text() rate.
+##############################################################################
+
+import sys
+import time
+import random
+import string
+
+import text_parser
+
+
+if len(sys.argv) > 2:
+  print('usage: {} [#comments]'.format(sys.argv[0]))
+  sys.exit(1)
+
+NCOMMENTS = int(sys.argv[1]) if len(sys.argv) == 2 else 100000
+
+
+def make_comments(ncomments, seed=1):
+  '''
+    Build comments from a Zipf-ish vocabulary sprinkled with capitals,
+    punctuation, contractions, digits, links, newlines, and the odd
+    non-ASCII character.
+  '''
+  rng = random.Random(seed)
+  vocab = [''.join(rng.choice(string.ascii_lowercase)
+      for _ in range(rng.randint(1, 12))) for _ in range(20000)]
+  weights = [1.0 / (r + 1) for r in range(len(vocab))]
+
+  comments = []
+  for _ in range(ncomments):
+    words = rng.choices(vocab, weights, k=rng.randint(3, 120))
+    for i in range(len(words)):
+      r = rng.random()
+      if r < 0.08:
+        words[i] = words[i].capitalize()
+      elif r < 0.14:
+        words[i] += rng.choice(',.!?:;)')
+      elif r < 0.16:
+        words[i] += "'t"
+      elif r < 0.17:
+        words[i] += '\n\n'
+      elif r < 0.175:
+        words[i] = str(rng.randint(0, 10000))
+      elif r < 0.177:
+        words[i] = 'http://www.reddit.com/r/' + words[i]
+      elif r < 0.178:
+        words[i] += '’s'
+    comments.append(' '.join(words))
+  return comments
+
+
+def old_tokenize(text_string):
+  return text_string.translate(text_parser.filter_table).split()
+
+
+def bench(name, fn, comments, nbytes):
+  start = time.perf_counter()
+  ntokens = 0
+  for c in comments:
+    ntokens += len(fn(c))
+  secs = time.perf_counter() - start
+  print('{:<16s} {:8.3f}s  {:12,.0f} comments/s  {:8.1f} MB/s  ({:,d} tokens)'.format(
+      name, secs, len(comments) / secs, nbytes / secs / 1e6, ntokens))
+  return secs
+
+
+comments = make_comments(NCOMMENTS)
+nbytes = sum(len(c) for c in comments)
+print('{:,d} comments, {:,.1f} MB'.format(len(comments), nbytes / 1e6))
+
+for c in comments:
+  if old_tokenize(c) != text_parser.tokenize(c):
+    print('MISMATCH: {!r}'.format(c))
+    sys.exit(1)
+
+old_secs = bench('translate+split', old_tokenize, comments, nbytes)
+new_secs = bench('tokenize', text_parser.tokenize, comments, nbytes)
+print('speedup: {:0.2f}x'.format(old_secs / new_secs))
+
+bench('parse_text', lambda c: list(text_parser.parse_text(c)), comments, nbytes)
+print('stem cache: {}'.format(text_parser.stem_cache_info()))
@@ -2,17 +2,22 @@
 
 
 #
-# NOTE: due to some duplicated tagging, this script will emit duplicate
-# non-zeros. We merge them with a `max()` reduction, so the tensor remains
-# binary.
+# NOTE: due to some duplicated tagging, the raw data has duplicate non-zeros.
+# We merge them with a `max()` reduction, so the tensor remains binary.
 #
-# To fully replicate the tensor used in FROSTT:
+# With DEDUP = True (the default), this is done while parsing: both
+# delicious4d.tns and the order-3 delicious3d.tns (which drops the fourth
+# mode) are written sorted and free of duplicates, matching the FROSTT
+# tensors.
+#
+# With DEDUP = False, only delicious4d.tns is written, with the duplicates in
+# input order. To replicate the FROSTT tensor from it:
 #   $ ./parse_delicious.py
 #   $ splatt check delicious4d.tns --fix=fixed.tns
 #   $ awk '{print($1,$2,$3,$4,"1.0")}' fixed.tns > delicious4d.tns
 #
-# Generating the order-3 delicious tensor can be achieved by removing the
-# fourth mode (`awk` works well for this). More duplicate non-zeros will
+# Generating the order-3 delicious tensor can then be achieved by removing
+# the fourth mode (`awk` works well for this). More duplicate non-zeros will
 # appear, so perform the above process again.
 #
 
@@ -21,35 +26,38 @@
 import sys
 from dateutil import parser
 
+sys.path.append('../')
+sys.path.append('../../utilities')
+from id_map import IDMap
+from tensor_writer import open_tensor
+from reduce_nnz import ProjectionWriter
+
 ###############################################################################
 #
 # FILES - EDIT THESE
 #
 fin = open('delicious_UsrResTag', 'r')
-fout = open('delicious4d.tns', 'w')
 
-###############################################################################
+# remove duplicate non-zeros while parsing
+DEDUP = True
 
-def write_map(map_dic, fname):
-  # invert map_dic so we can print keys in order
-  lookup = [None] * len(map_dic)
-  for x in map_dic.keys():
-    lookup[map_dic[x] - 1] = x
+# distinct non-zeros held in memory per tensor before spilling to disk
+DEDUP_MAX_ENTRIES = 1 << 24
 
-  with open(fname, 'w') as fout:
-    for x in lookup:
-      print(x, file=fout)
+if DEDUP:
+  fout = ProjectionWriter(None, 4,
+      [((0, 1, 2, 3), 'delicious4d.tns', 'max'),
+       ((0, 1, 2),    'delicious3d.tns', 'max')],
+      max_entries=DEDUP_MAX_ENTRIES, value=1.0)
+else:
+  fout = open_tensor('delicious4d.tns', 4)
 
+###############################################################################
 
-def get_map_id(map_dic, key):
-  if key not in map_dic:
-    map_dic[key] = len(map_dic) + 1
-  return map_dic[key]
-
-users = dict()
-items = dict()
-tags  = dict()
-times = dict()
+users = IDMap()
+items = IDMap()
+tags  = IDMap()
+times = IDMap()
 
 # file is in the format: date, userID, itemID, tag
 for line in fin:
@@ -62,23 +70,24 @@ for line in fin:
     item = l[3]
     tag = ''.join(l[4:])
 
-    time_id = get_map_id(times, time)
-    user_id = get_map_id(users, user)
-    item_id = get_map_id(items, item)
-    tag_id = get_map_id(tags, tag)
+    time_id = times.assign(time)
+    user_id = users.assign(user)
+    item_id = items.assign(item)
+    tag_id = tags.assign(tag)
 
-    print('{} {} {} {} 1.0'.format(user_id, item_id, tag_id, time_id), file=fout)
+    fout.write(user_id, item_id, tag_id, time_id, 1.0)
 
 fin.close()
 fout.close()
+print(fout.report())
 
 print('#users: {}'.format(len(users)))
 print('#items: {}'.format(len(items)))
 print('#tags: {}'.format(len(tags)))
 print('#times: {}'.format(len(times)))
 
-write_map(users, 'mode-1-users.map')
-write_map(items, 'mode-2-items.map')
-write_map(tags,  'mode-3-tags.map')
-write_map(times, 'mode-4-days.map')
+users.write('mode-1-users.map')
+items.write('mode-2-items.map')
+tags.write('mode-3-tags.map')
+times.write('mode-4-days.map')
 
@@ -11,7 +11,21 @@ import numpy as np
 import pandas as pd
 
 sys.path.append('../')
+sys.path.append('../../utilities')
 import text_parser
+from id_map import IDMap
+from tensor_writer import open_tensor
+
+
+##############################################################################
+# CONSTANTS - EDIT THESE FOR YOUR OWN SETUP
+
+# stems shared with other dataset builds (set to None to disable)
+STEM_TABLE = '../stems.table'
+
+# processes used to tokenize email bodies
+NUM_WORKERS = os.cpu_count()
+##############################################################################
 
 
 ##############################################################################
@@ -75,44 +89,48 @@ emails_df.dtypes
 #
 ##############################################################################
 
-def assign_id(dic, item):
-  if item not in dic:
-    dic[item] = len(dic) + 1
-
-people = dict()
-dates = dict()
-words = dict()
+people = IDMap()
+dates = IDMap()
+words = IDMap()
 
 
 # dictionary of people -- we only want people that sent an email
 for fset in emails_df['From']:
   for curr_user in fset:
     if '@enron.com' in curr_user:
-      assign_id(people, curr_user)
+      people.assign(curr_user)
 
 # dictionary of sorted dates
 for timestamp in emails_df['Date']:
-  assign_id(dates, timestamp.date())
-# reassign date IDs to be sorted
-date_ids = dict()
-for d in sorted(dates):
-  # skip some invalid dates
-  if d.year < 1995 or d.year > 2002:
-    continue
-  assign_id(date_ids, d)
-dates = date_ids
+  dates.assign(timestamp.date())
+# reassign date IDs to be sorted, skipping some invalid dates
+dates = IDMap.sorted(d for d in dates if 1995 <= d.year <= 2002)
 
 
 skip_words = set(['>', 'Subject:'])
 
 nnz = 0
 
+if STEM_TABLE:
+  print('stem table: {:,d} stems'.format(text_parser.load_stem_table(STEM_TABLE)))
+
+# Only emails sent from enron.com on a valid date make nonzeros, so only
+# those are tokenized.
+def keep_email(idx):
+  if '@enron.com' not in list(emails_df['From'][idx])[0]:
+    return False
+  # skip some invalid dates
+  d = emails_df['Date'][idx]
+  return 1995 <= d.year <= 2002
+
+kept = [idx for idx in range(len(emails_df['From'])) if keep_email(idx)]
+
 # Parse words and generate non-zeros
-fout = open(sys.argv[2], 'w')
-for idx in range(len(emails_df['From'])):
+fout = open_tensor(sys.argv[2], 4, value_type='q')
+token_lists = text_parser.parse_texts(
+    (emails_df['content'][idx] for idx in kept), NUM_WORKERS)
+for idx, content_words in zip(kept, token_lists):
   s = list(emails_df['From'][idx])[0]
-  if '@enron.com' not in s:
-    continue
 
   # list because it's a frozenset
   sender = people[s]
@@ -124,47 +142,33 @@ for idx in range(len(emails_df['From'])):
     for rec in emails_df['To'][idx]:
       if rec in people:
         recvs.append(people[rec])
-  
-  # skip some invalid dates
-  d = emails_df['Date'][idx]
-  if d.year < 1995 or d.year > 2002:
-    continue
 
   # get date
   date = dates[emails_df['Date'][idx].date()]
 
-  for word in text_parser.parse_text(emails_df['content'][idx]):
+  for word in content_words:
     # quoted original message is at the bottom and starts with this
     if '-----Origin' in word or 'http' in word:
       break
-    assign_id(words, word)
-    word_id = words[word]
+    word_id = words.assign(word)
 
     for r in recvs:
-      print('{} {} {} {} 1'.format(sender, r, word_id, date), file=fout)
+      fout.write(sender, r, word_id, date, 1)
       nnz += 1
 fout.close()
+text_parser.close_stem_table()
+print(fout.report())
 
 
 print('{:,d} people'.format(len(people)))
 print('{:,d} dates'.format(len(dates)))
 print('{:,d} words'.format(len(words)))
 print('{:,d} nnz'.format(nnz))
-
-
-def write_ids(fname, dic):
-  # invert dictionary first
-  inv = {}
-  for x in dic.keys():
-    inv[dic[x]] = x
-
-  with open(fname, 'w') as f:
-    for i in range(1, len(dic)+1):
-      f.write('{}\n'.format(inv[i]))
+print('stem cache: {}'.format(text_parser.stem_cache_info()))
 
 # Write keys
-write_ids('mode-1-senders.map', people)
-write_ids('mode-2-receivers.map', people)
-write_ids('mode-3-words.map', words)
-write_ids('mode-4-dates.map', dates)
+people.write('mode-1-senders.map')
+people.write('mode-2-receivers.map')
+words.write('mode-3-words.map')
+dates.write('mode-4-dates.map')
 
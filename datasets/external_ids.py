@@ -0,0 +1,298 @@
+
+import os
+import sys
+import heapq
+import zlib
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'utilities'))
+import map_file
+
+
+##############################################################################
+# External-memory counting and ID assignment for vocabularies which do not
+# fit in RAM.
+#
+# Keys are hash-partitioned into bucket files, so that each bucket can later
+# be counted and numbered on its own. Keys must be strings without tabs or
+# newlines (users, subreddits, and stemmed words all qualify).
+##############################################################################
+
+
+def bucket_of(key, nbuckets):
+  # crc32 rather than hash(), which is salted per process
+  return zlib.crc32(key.encode('utf-8')) % nbuckets
+
+
+class SpillCounter:
+  '''
+    Counts keys like collections.Counter, holding at most max_keys distinct
+    keys in memory before spilling them to nbuckets partition files. The
+    position at which each key first appeared is tracked as well, so that IDs
+    can be handed out in the same first-occurrence order that iterating a
+    Counter gives.
+  '''
+
+  def __init__(self, max_keys=1 << 22, nbuckets=64, tmpdir=None):
+    self.max_keys = max_keys
+    self.nbuckets = nbuckets
+    self.tmpdir = tempfile.TemporaryDirectory(prefix='spill-', dir=tmpdir)
+    self.nspills = 0
+
+    # key -> [count, first position]
+    self.counts = {}
+    self.seen = 0
+
+  def __len__(self):
+    # exact only before the first spill
+    return len(self.counts)
+
+  def _bucket_fname(self, b):
+    return os.path.join(self.tmpdir.name, 'bucket-{}'.format(b))
+
+  def add(self, key, n=1):
+    entry = self.counts.get(key)
+    if entry is None:
+      self.counts[key] = [n, self.seen]
+      if len(self.counts) >= self.max_keys:
+        self.spill()
+    else:
+      entry[0] += n
+    self.seen += 1
+
+  def update(self, keys):
+    '''
+      Count each key of an iterable, or add the counts of a mapping (such as
+      another Counter), like Counter.update().
+    '''
+    if hasattr(keys, 'items'):
+      for key, n in keys.items():
+        self.add(key, n)
+      return
+    for key in keys:
+      self.add(key)
+
+  def spill(self):
+    '''
+      Append the in-memory counts to the bucket files and clear them.
+    '''
+    bfiles = [open(self._bucket_fname(b), 'a') for b in range(self.nbuckets)]
+    for key, (count, first) in self.counts.items():
+      bfiles[bucket_of(key, self.nbuckets)].write(
+          '{}\t{}\t{}\n'.format(key, count, first))
+    for bfile in bfiles:
+      bfile.close()
+    self.counts = {}
+    self.nspills += 1
+
+  def buckets(self):
+    '''
+      Yield one dict of key -> [count, first] per bucket, with the counts of
+      all spills merged. Only a single bucket is held in memory at a time.
+    '''
+    if self.nspills == 0:
+      yield self.counts
+      return
+
+    if self.counts:
+      self.spill()
+    for b in range(self.nbuckets):
+      merged = {}
+      fname = self._bucket_fname(b)
+      if not os.path.exists(fname):
+        continue
+      with open(fname, 'r') as fin:
+        for line in fin:
+          key, count, first = line.rstrip('\n').split('\t')
+          entry = merged.get(key)
+          if entry is None:
+            merged[key] = [int(count), int(first)]
+          else:
+            entry[0] += int(count)
+            entry[1] = min(entry[1], int(first))
+      yield merged
+
+  def items(self):
+    for bucket in self.buckets():
+      for key, (count, first) in bucket.items():
+        yield key, count
+
+  def most_common(self, n):
+    return heapq.nlargest(n, self.items(), key=lambda kv: kv[1])
+
+  def assign_ids(self, keep=None, order='first', counts_fname=None):
+    '''
+      Assign IDs 1..N to the keys whose count satisfies keep(count), either
+      in order of first appearance (order='first') or sorted (order='sorted').
+      If counts_fname is given, "count key" lines are written to it in ID
+      order. Returns an ExternalIDMap.
+    '''
+    ids = ExternalIDMap(self.nbuckets, tmpdir=os.path.dirname(self.tmpdir.name))
+
+    # write each bucket's kept keys as a run sorted in ID order
+    runs = []
+    for b, bucket in enumerate(self.buckets()):
+      if order == 'first':
+        entries = [(first, key, count) for key, (count, first) in
+            bucket.items() if keep is None or keep(count)]
+      else:
+        entries = [(key, key, count) for key, (count, first) in
+            bucket.items() if keep is None or keep(count)]
+      entries.sort()
+      fname = os.path.join(ids.tmpdir.name, 'run-{}'.format(b))
+      with open(fname, 'w') as fout:
+        for sort_key, key, count in entries:
+          fout.write('{}\t{}\t{}\n'.format(sort_key, key, count))
+      runs.append(fname)
+      del entries
+
+    def read_run(fname):
+      with open(fname, 'r') as fin:
+        for line in fin:
+          sort_key, key, count = line.rstrip('\n').split('\t')
+          if order == 'first':
+            sort_key = int(sort_key)
+          yield sort_key, key, int(count)
+
+    # merge the runs and number keys in order
+    counts_file = open(counts_fname, 'w') if counts_fname else None
+    with ids.writer() as add:
+      for sort_key, key, count in heapq.merge(*map(read_run, runs)):
+        add(key)
+        if counts_file:
+          counts_file.write('{} {}\n'.format(count, key))
+    if counts_file:
+      counts_file.close()
+
+    for fname in runs:
+      os.remove(fname)
+    return ids
+
+
+class ExternalIDMap:
+  '''
+    A key -> ID map kept on disk as per-bucket tables, plus the map file of
+    keys in ID order. Lookups are done in bulk with get_many_lists(), which
+    joins the keys of many lists against one bucket at a time.
+  '''
+
+  def __init__(self, nbuckets, tmpdir=None):
+    self.nbuckets = nbuckets
+    self.tmpdir = tempfile.TemporaryDirectory(prefix='ids-', dir=tmpdir)
+    self.nkeys = 0
+
+  def __len__(self):
+    return self.nkeys
+
+  def _fname(self, name):
+    return os.path.join(self.tmpdir.name, name)
+
+  def writer(self):
+    '''
+      Context manager returning add(key), which gives key the next ID.
+    '''
+    idmap = self
+
+    class _Writer:
+      def __enter__(self):
+        self.keys = open(idmap._fname('keys.map'), 'w')
+        self.tables = [open(idmap._fname('table-{}'.format(b)), 'w')
+            for b in range(idmap.nbuckets)]
+        return self.add
+
+      def add(self, key):
+        idmap.nkeys += 1
+        self.keys.write('{}\n'.format(key))
+        self.tables[bucket_of(key, idmap.nbuckets)].write(
+            '{}\t{}\n'.format(key, idmap.nkeys))
+
+      def __exit__(self, *exc):
+        self.keys.close()
+        for table in self.tables:
+          table.close()
+
+    return _Writer()
+
+  def table(self, b):
+    '''
+      Load the key -> ID dict of bucket b.
+    '''
+    ids = {}
+    with open(self._fname('table-{}'.format(b)), 'r') as fin:
+      for line in fin:
+        key, key_id = line.rstrip('\n').split('\t')
+        ids[key] = int(key_id)
+    return ids
+
+  def write(self, fname):
+    '''
+      Write one key per line in ID order, plus the offsets sidecar used by
+      map_file.MapIndex.
+    '''
+    with open(self._fname('keys.map'), 'r') as fin:
+      map_file.write_map(fname, (line.rstrip('\n') for line in fin))
+
+  def nbytes(self):
+    '''
+      The bulk of the map lives on disk; only the object itself is resident.
+    '''
+    return sys.getsizeof(self)
+
+  def get_many(self, keys, default=None):
+    '''
+      Look up the IDs of keys, like IDMap.get_many().
+    '''
+    return next(self.get_many_lists([keys], default))
+
+  def get_many_lists(self, key_lists, default=None):
+    '''
+      Yield get_many() of each of key_lists, in order. The keys of every list
+      are partitioned by bucket first, and each partition is joined against
+      its bucket's table, so that each table is loaded once however many
+      lists there are, and only one at a time.
+    '''
+    tmp = tempfile.TemporaryDirectory(prefix='lookup-', dir=self.tmpdir.name)
+    part_fnames = [os.path.join(tmp.name, 'part-{}'.format(b))
+        for b in range(self.nbuckets)]
+    parts = [open(fname, 'w') for fname in part_fnames]
+    lengths = []
+    for i, keys in enumerate(key_lists):
+      nkeys = 0
+      for pos, key in enumerate(keys):
+        parts[bucket_of(key, self.nbuckets)].write(
+            '{}\t{}\t{}\n'.format(i, pos, key))
+        nkeys += 1
+      lengths.append(nkeys)
+    for part in parts:
+      part.close()
+
+    # the IDs found in each partition stay in (list, position) order
+    found_fnames = []
+    for b, fname in enumerate(part_fnames):
+      ids = self.table(b)
+      found_fname = os.path.join(tmp.name, 'found-{}'.format(b))
+      with open(fname, 'r') as fin, open(found_fname, 'w') as fout:
+        for line in fin:
+          i, pos, key = line.rstrip('\n').split('\t', 2)
+          key_id = ids.get(key)
+          if key_id is not None:
+            fout.write('{}\t{}\t{}\n'.format(i, pos, key_id))
+      os.remove(fname)
+      found_fnames.append(found_fname)
+      del ids
+
+    def read_found(fname):
+      with open(fname, 'r') as fin:
+        for line in fin:
+          yield tuple(map(int, line.split('\t')))
+
+    found = heapq.merge(*map(read_found, found_fnames))
+    entry = next(found, None)
+    for i, nkeys in enumerate(lengths):
+      key_ids = [default] * nkeys
+      while entry is not None and entry[0] == i:
+        key_ids[entry[1]] = entry[2]
+        entry = next(found, None)
+      yield key_ids
+    tmp.cleanup()
@@ -2,55 +2,61 @@
 
 
 #
-# NOTE: due to some duplicated tagging, this script will emit duplicate
-# non-zeros. We merge them with a `max()` reduction, so the tensor remains
-# binary.
+# NOTE: due to some duplicated tagging, the raw data has duplicate non-zeros.
+# We merge them with a `max()` reduction, so the tensor remains binary.
 #
-# To fully replicate the tensor used in FROSTT:
+# With DEDUP = True (the default), this is done while parsing: both
+# flickr4d.tns and the order-3 flickr3d.tns (which drops the fourth mode) are
+# written sorted and free of duplicates, matching the FROSTT tensors.
+#
+# With DEDUP = False, flickr4d.tns keeps the duplicates in input order. To
+# replicate the FROSTT tensor from it:
 #   $ ./parse_flickr.py
 #   $ splatt check flickr4d.tns --fix=fixed.tns
 #   $ awk '{print($1,$2,$3,$4,"1.0")}' fixed.tns > flickr4d.tns
 #
-# Generating the order-3 flickr tensor can be achieved by removing the
-# fourth mode (`awk` works well for this). More duplicate non-zeros will
-# appear, so perform the above process again.
-#
 
 
 
 import sys
 from dateutil import parser
 
+sys.path.append('../')
+sys.path.append('../../utilities')
+from id_map import IDMap
+from reduce_nnz import ProjectionWriter
 
-if len(sys.argv) == 1:
-  print('usage: {} <data>'.format(sys.argv[0]))
-  sys.exit(1)
 
+###############################################################################
+# CONSTANTS - EDIT THESE FOR YOUR OWN SETUP
 
-def write_map(map_dic, fname):
-  # invert map_dic so we can print keys in order
-  lookup = [None] * len(map_dic)
-  for x in map_dic.keys():
-    lookup[map_dic[x] - 1] = x
+# remove duplicate non-zeros while parsing
+DEDUP = True
 
-  with open(fname, 'w') as fout:
-    for x in lookup:
-      print(x, file=fout)
+# distinct non-zeros held in memory per tensor before spilling to disk
+DEDUP_MAX_ENTRIES = 1 << 24
+###############################################################################
 
 
-def get_map_id(map_dic, key):
-  if key not in map_dic:
-    map_dic[key] = len(map_dic) + 1
-  return map_dic[key]
+if len(sys.argv) == 1:
+  print('usage: {} <data>'.format(sys.argv[0]))
+  sys.exit(1)
+
 
-users = dict()
-items = dict()
-tags  = dict()
-times = dict()
+users = IDMap()
+items = IDMap()
+tags  = IDMap()
+times = IDMap()
 
 # file is in the format: date, userID, itemID, tag
-fout4 = open('flickr4d.tns', 'w')
-fout3 = open('flickr3d.tns', 'w')
+if DEDUP:
+  fout = ProjectionWriter(None, 4,
+      [((0, 1, 2, 3), 'flickr4d.tns', 'max'),
+       ((0, 1, 2),    'flickr3d.tns', 'max')],
+      max_entries=DEDUP_MAX_ENTRIES, value=1.0)
+else:
+  fout = ProjectionWriter('flickr4d.tns', 4,
+      [((0, 1, 2), 'flickr3d.tns', 'max')])
 
 with open(sys.argv[1], 'r') as fin:
   for line in fin:
@@ -63,24 +69,23 @@ with open(sys.argv[1], 'r') as fin:
       item = l[3]
       tag = ''.join(l[4:])
 
-      time_id = get_map_id(times, time)
-      user_id = get_map_id(users, user)
-      item_id = get_map_id(items, item)
-      tag_id = get_map_id(tags, tag)
+      time_id = times.assign(time)
+      user_id = users.assign(user)
+      item_id = items.assign(item)
+      tag_id = tags.assign(tag)
 
-      print('{} {} {} {} 1.0'.format(user_id, item_id, tag_id, time_id), file=fout4)
-      print('{} {} {} 1.0'.format(user_id, item_id, tag_id), file=fout3)
+      fout.write(user_id, item_id, tag_id, time_id, 1.0)
 
-fout4.close()
-fout3.close()
+fout.close()
+print(fout.report())
 
 print('#users: {}'.format(len(users)))
 print('#items: {}'.format(len(items)))
 print('#tags: {}'.format(len(tags)))
 print('#times: {}'.format(len(times)))
 
-write_map(users, 'mode-1-users.map')
-write_map(items, 'mode-2-items.map')
-write_map(tags,  'mode-3-tags.map')
-write_map(times, 'mode-4-days.map')
+users.write('mode-1-users.map')
+items.write('mode-2-items.map')
+tags.write('mode-3-tags.map')
+times.write('mode-4-days.map')
 
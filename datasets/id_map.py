@@ -0,0 +1,163 @@
+
+import os
+import sys
+import heapq
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'utilities'))
+import map_file
+
+
+class IDMap:
+  '''
+    Assigns contiguous 1-based IDs to keys in order of first appearance.
+
+    The key -> ID dict is the only store. Dicts keep insertion order and IDs
+    are handed out in that order, so iterating the dict lists the keys in ID
+    order: map files are written straight from it, without an inverted dict.
+  '''
+
+  def __init__(self, keys=()):
+    self._ids = {}
+    self.assign_many(keys)
+
+  @classmethod
+  def sorted(cls, keys):
+    '''
+      Build a map whose IDs follow the sorted order of keys.
+    '''
+    return cls(sorted(keys))
+
+  def __len__(self):
+    return len(self._ids)
+
+  def __contains__(self, key):
+    return key in self._ids
+
+  def __iter__(self):
+    '''
+      Iterate over keys in ID order.
+    '''
+    return iter(self._ids)
+
+  def __getitem__(self, key):
+    return self._ids[key]
+
+  def get(self, key, default=None):
+    return self._ids.get(key, default)
+
+  def assign(self, key):
+    '''
+      Return the ID of key, assigning the next one if it is new.
+    '''
+    key_id = self._ids.get(key)
+    if key_id is None:
+      key_id = self._ids[key] = len(self._ids) + 1
+    return key_id
+
+  def assign_many(self, keys):
+    '''
+      assign() each of keys and return the list of their IDs.
+    '''
+    ids = self._ids
+    out = []
+    for key in keys:
+      key_id = ids.get(key)
+      if key_id is None:
+        key_id = ids[key] = len(ids) + 1
+      out.append(key_id)
+    return out
+
+  def get_many(self, keys, default=None):
+    '''
+      Look up the IDs of keys without assigning new ones.
+    '''
+    get = self._ids.get
+    return [get(key, default) for key in keys]
+
+  def get_many_lists(self, key_lists, default=None):
+    '''
+      Yield get_many() of each of key_lists, in order.
+    '''
+    for keys in key_lists:
+      yield self.get_many(keys, default)
+
+  def write(self, fname):
+    '''
+      Write one key per line in ID order, plus the offsets sidecar used by
+      map_file.MapIndex.
+    '''
+    map_file.write_map(fname, self._ids)
+
+  def nbytes(self):
+    '''
+      Approximate memory used by the map, including its keys and IDs.
+    '''
+    return sys.getsizeof(self._ids) + sum(sys.getsizeof(key) +
+        sys.getsizeof(key_id) for key, key_id in self._ids.items())
+
+
+class KeyCounter(IDMap):
+  '''
+    An IDMap which also counts how many times each key was added. IDs follow
+    first appearance, which is also the order a Counter iterates in, so the
+    IDs double as compact provisional codes for the keys.
+
+    Pickles hold only the keys and counts; the key -> ID dict is rebuilt on
+    load.
+  '''
+
+  def __init__(self, keys=()):
+    # counts[i] is the count of ID i; slot 0 is unused
+    self.counts = [0]
+    IDMap.__init__(self)
+    self.add_many(keys)
+
+  def __getstate__(self):
+    return list(self._ids), self.counts
+
+  def __setstate__(self, state):
+    keys, self.counts = state
+    self._ids = {key: key_id for key_id, key in enumerate(keys, 1)}
+
+  def count(self, key):
+    key_id = self._ids.get(key)
+    return 0 if key_id is None else self.counts[key_id]
+
+  def add(self, key, n=1):
+    '''
+      Count key n times and return its ID.
+    '''
+    key_id = self.assign(key)
+    if key_id == len(self.counts):
+      self.counts.append(n)
+    else:
+      self.counts[key_id] += n
+    return key_id
+
+  def add_many(self, keys):
+    '''
+      Count each of keys once and return the list of their IDs.
+    '''
+    key_ids = self.assign_many(keys)
+    counts = self.counts
+    counts.extend([0] * (len(self._ids) + 1 - len(counts)))
+    for key_id in key_ids:
+      counts[key_id] += 1
+    return key_ids
+
+  def update(self, other):
+    '''
+      Add the counts of another KeyCounter (or mapping) in its ID order, and
+      return the IDs its keys have here.
+    '''
+    return [self.add(key, n) for key, n in other.items()]
+
+  def items(self):
+    '''
+      (key, count) pairs in ID order.
+    '''
+    return zip(self._ids, self.counts[1:])
+
+  def most_common(self, n):
+    return heapq.nlargest(n, self.items(), key=lambda kv: kv[1])
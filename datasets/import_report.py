@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import ast
+import glob
+import argparse
+import subprocess
+
+
+my_description = '''
+Report the import-time cost of each dataset parser. The modules imported by
+each parser script are collected without running it, and then imported in a
+fresh interpreter under `python -X importtime` from the parser's directory.
+Modules whose cumulative import time exceeds the budget are flagged, and the
+exit status is non-zero if any parser is over its total budget.
+
+Modules that are not installed are reported as missing and not timed.
+'''
+
+parser = argparse.ArgumentParser(description=my_description,
+    formatter_class=argparse.RawTextHelpFormatter)
+
+parser.add_argument('scripts', type=str, nargs='*',
+    help='parser scripts (default: all datasets/*/parse_*.py)')
+parser.add_argument('--budget', type=float, default=250.,
+    help='total import budget per parser, in ms (default: 250)')
+parser.add_argument('--module-budget', type=float, default=50.,
+    help='import budget per module, in ms (default: 50)')
+
+args = parser.parse_args()
+
+here = os.path.dirname(os.path.abspath(__file__))
+scripts = args.scripts or sorted(glob.glob(os.path.join(here, '*', 'parse_*.py')))
+
+
+def imported_modules(fname):
+  '''
+    Return the top-level names of all modules imported by a script, in the
+    order they first appear.
+  '''
+  with open(fname, 'r') as fin:
+    tree = ast.parse(fin.read(), fname)
+
+  mods = []
+  for node in ast.walk(tree):
+    if isinstance(node, ast.Import):
+      names = [alias.name for alias in node.names]
+    elif isinstance(node, ast.ImportFrom) and node.level == 0:
+      names = [node.module]
+    else:
+      continue
+    for name in names:
+      name = name.split('.')[0]
+      if name not in mods:
+        mods.append(name)
+  return mods
+
+
+# Import each module separately so one missing dependency does not hide the
+# cost of the others.
+probe = '''
+import sys
+sys.path[:0] = ['..', '../../utilities']
+for mod in sys.argv[1:]:
+  try:
+    # __import__ rather than importlib, which -X importtime does not see
+    __import__(mod)
+  except ImportError:
+    print(mod)
+'''
+
+def time_imports(script, mods):
+  '''
+    Import mods from the directory of script and return a dict of
+    cumulative import times (ms) and the list of missing modules.
+  '''
+  proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe] + mods,
+      cwd=os.path.dirname(os.path.abspath(script)), capture_output=True,
+      text=True)
+
+  times = {}
+  for line in proc.stderr.splitlines():
+    # import time: self [us] | cumulative | imported package
+    if not line.startswith('import time:'):
+      continue
+    fields = line[len('import time:'):].split('|')
+    if len(fields) != 3 or not fields[0].strip().isdigit():
+      continue
+    name = fields[2].rstrip()
+    # nested imports are indented below the module that triggered them
+    if name.startswith(' ') and name.lstrip() in mods:
+      name = name.strip()
+    if name in mods:
+      times[name] = int(fields[1]) / 1000.
+  return times, proc.stdout.split()
+
+
+over = False
+for script in scripts:
+  mods = imported_modules(script)
+  times, missing = time_imports(script, mods)
+  total = sum(times.values())
+
+  status = 'OK'
+  if total > args.budget:
+    status = 'OVER BUDGET'
+    over = True
+  print('{}: {:0.1f} ms ({})'.format(os.path.relpath(script), total, status))
+
+  for mod in mods:
+    if mod in missing:
+      print('  {:<16s} missing'.format(mod))
+    elif mod in times:
+      flag = ' *' if times[mod] > args.module_budget else ''
+      print('  {:<16s} {:8.1f} ms{}'.format(mod, times[mod], flag))
+
+sys.exit(1 if over else 0)
@@ -3,32 +3,16 @@
 import sys
 import re
 
+sys.path.append('../')
+sys.path.append('../../utilities')
+from id_map import IDMap
+from tensor_writer import open_tensor
+
 if len(sys.argv) == 1:
   print('usage: {} <parsed TCPDUMP files>'.format(sys.argv[0]))
   print('run `tcpdump -tt -n -r <.anon> > out.txt` to parse.')
   sys.exit(0)
 
-def get_id(dic, item):
-  if item not in dic:
-    dic[item] = 1 + len(dic)
-  return dic[item]
-
-def write_ids(dic, fname):
-  with open(fname, 'w') as ofile:
-    inv = {}
-    for i in dic:
-      inv[dic[i]] = i
-    for i in range(1, 1+len(inv)):
-      print(inv[i], file=ofile)
-
-
-def sort_ids(dic):
-# write times (and make IDs sorted)
-  newids = {}
-  for t in sorted(dic.keys()):
-    get_id(newids, t)
-  return newids
-
 def parse_time(s):
   # truncate last 4 digits
   return float(s[:-4])
@@ -37,11 +21,11 @@ def parse_time(s):
 address_re = re.compile('([\d+\.]+)\.(\d+):?$')
 length_re = re.compile('length (\d+)\[\|SMB\]')
 
-times = {}
-send_ips = {}
-send_ports = {}
-dest_ips = {}
-dest_ports = {}
+times = IDMap()
+send_ips = IDMap()
+send_ports = IDMap()
+dest_ips = IDMap()
+dest_ports = IDMap()
 
 nnz = 0
 
@@ -66,13 +50,13 @@ for rawfile in sys.argv[1:]:
 
       # truncate time to seconds
       secs = parse_time(line[0])
-      times[secs] = 1
+      times.assign(secs)
 
       send_add = line[2]
       m = address_re.match(send_add)
       if m:
-        get_id(send_ips, m.group(1))
-        get_id(send_ports, int(m.group(2)))
+        send_ips.assign(m.group(1))
+        send_ports.assign(int(m.group(2)))
       else:
         print('ERROR: {}'.format(send_add))
 
@@ -80,8 +64,8 @@ for rawfile in sys.argv[1:]:
       dest_add = line[4]
       m = address_re.match(dest_add)
       if m:
-        get_id(dest_ips, m.group(1))
-        get_id(dest_ports, int(m.group(2)))
+        dest_ips.assign(m.group(1))
+        dest_ports.assign(int(m.group(2)))
       else:
         print('ERROR: {}'.format(dest_add))
 
@@ -95,19 +79,19 @@ print('dest ports: {}'.format(len(dest_ports)))
 print('times: {}'.format(len(times)))
 
 # sort ids
-times = sort_ids(times)
-send_ports = sort_ids(send_ports)
-dest_ports = sort_ids(dest_ports)
+times = IDMap.sorted(times)
+send_ports = IDMap.sorted(send_ports)
+dest_ports = IDMap.sorted(dest_ports)
 
-write_ids(send_ips, 'send_ips.txt')
-write_ids(send_ports, 'send_ports.txt')
-write_ids(dest_ips, 'dest_ips.txt')
-write_ids(dest_ports, 'dest_ports.txt')
-write_ids(times, 'times.txt')
+send_ips.write('send_ips.txt')
+send_ports.write('send_ports.txt')
+dest_ips.write('dest_ips.txt')
+dest_ports.write('dest_ports.txt')
+times.write('times.txt')
 
 
 # go back over data and write nonzeros!
-tensor = open('lbnl.tns', 'w')
+tensor = open_tensor('lbnl.tns', 5, value_type='q')
 for rawfile in sys.argv[1:]:
   with open(rawfile, 'r') as infile:
 
@@ -155,7 +139,7 @@ for rawfile in sys.argv[1:]:
 
 
       # now write nonzero!
-      print('{} {} {} {} {} {}'.format(send_ip, send_port, dest_ip, dest_port,
-          secs, length), file=tensor)
+      tensor.write(send_ip, send_port, dest_ip, dest_port, secs, length)
 
 tensor.close()
+print(tensor.report())
@@ -30,19 +30,24 @@ import sys
 import csv
 from collections import defaultdict
 
+sys.path.append('../')
+sys.path.append('../../utilities')
+from id_map import IDMap
+from tensor_writer import open_tensor
+
 
 ###############################################################################
 # GLOBAL DICTIONARIES
 #
 # dic[orig_key] = new_id
 ###############################################################################
-user_ids    = dict()
-tag_ids     = dict()
-date_ids    = dict()
+user_ids    = IDMap()
+tag_ids     = IDMap()
+date_ids    = IDMap()
 
 # to be used with lookup_movie(orig_key)
 movie_names = dict() # movie_names[orig_key] = 'Movie title'
-movie_ids   = dict() # movie_ids['Movie title'] = my_id
+movie_ids   = IDMap() # movie_ids['Movie title'] = my_id
 
 # rated_movies['title'] present if rated
 rated_movies = set()
@@ -58,25 +63,6 @@ def convert_utc(utc_int):
   return int(utc_int / (60 * 60 * 24))
 
 
-def write_ids(fname, dic):
-  # invert dictionary first
-  # (dic[key] = id) -> (inv[id] = key)
-  inv = {}
-  for x in dic.keys():
-    inv[dic[x]] = x
-
-  with open(fname, 'w') as fout:
-    for i in range(1, len(dic)+1):
-      print('{}'.format(inv[i]), file=fout)
-
-def assign_id(dic, item):
-  if item not in dic:
-    dic[item] = 1 + len(dic)
-
-def get_id(dic, item):
-  return dic[item]
-
-
 def read_csv(fname):
   with open(fname, 'r') as csvfile:
     csvreader = csv.reader(csvfile, delimiter=',', quotechar='"')
@@ -111,43 +97,45 @@ def assign_tag_ids(fname):
     orig_movie_id = int(row[1])
     title = movie_names[orig_movie_id]
     if title in rated_movies:
-      assign_id(user_ids, int(row[0]))
-      assign_id(movie_ids, title)
-      assign_id(tag_ids, row[2].lower())
-      assign_id(date_ids, convert_utc(int(row[3])))
+      user_ids.assign(int(row[0]))
+      movie_ids.assign(title)
+      tag_ids.assign(row[2].lower())
+      date_ids.assign(convert_utc(int(row[3])))
 
 
 def assign_rating_ids(fname):
   for row in read_csv(fname):
-    assign_id(user_ids, int(row[0]))
+    user_ids.assign(int(row[0]))
     title = movie_names[int(row[1])]
-    assign_id(movie_ids, title)
-    assign_id(date_ids, convert_utc(int(row[3])))
+    movie_ids.assign(title)
+    date_ids.assign(convert_utc(int(row[3])))
 
 
 def write_ratings(fname, ofname):
-  with open(ofname, 'w') as rating_file:
+  with open_tensor(ofname, 3) as rating_file:
     for row in read_csv(fname):
-      u = get_id(user_ids, int(row[0]))
-      m = get_id(movie_ids, movie_names[int(row[1])])
+      u = user_ids[int(row[0])]
+      m = movie_ids[movie_names[int(row[1])]]
       r = row[2]
-      d = get_id(date_ids, convert_utc(int(row[3])))
+      d = date_ids[convert_utc(int(row[3]))]
 
-      print('{} {} {} {}'.format(u, m, d, r), file=rating_file)
+      rating_file.write(u, m, d, r)
+  print(rating_file.report())
 
 
 
 def write_tags(fname, ofname):
-  with open(ofname, 'w') as tag_file:
+  with open_tensor(ofname, 4, value_type='q') as tag_file:
     for row in read_csv(fname):
       m_orig = int(row[1])
       title = movie_names[m_orig]
       if title in rated_movies:
-        u = get_id(user_ids, int(row[0]))
-        m = get_id(movie_ids, title)
-        t = get_id(tag_ids, row[2].lower())
-        d = get_id(date_ids, convert_utc(int(row[3])))
-        print('{} {} {} {} 1'.format(u, m, t, d), file=tag_file)
+        u = user_ids[int(row[0])]
+        m = movie_ids[title]
+        t = tag_ids[row[2].lower()]
+        d = date_ids[convert_utc(int(row[3]))]
+        tag_file.write(u, m, t, d, 1)
+  print(tag_file.report())
 
 
 
@@ -178,17 +166,13 @@ print('dates: {:,d}'.format(len(date_ids)))
 
 
 # assign time IDs so they are sorted
-uniques = sorted(date_ids.keys())
-date_ids = dict()
-for i in range(len(uniques)):
-  date_ids[uniques[i]] = i + 1
-del uniques
+date_ids = IDMap.sorted(date_ids)
 
 
-write_ids('mode-1-users.map',  user_ids)
-write_ids('mode-2-movies.map', movie_ids)
-write_ids('mode-3-tags.map',   tag_ids)
-write_ids('mode-4-dates.map',  date_ids)
+user_ids.write('mode-1-users.map')
+movie_ids.write('mode-2-movies.map')
+tag_ids.write('mode-3-tags.map')
+date_ids.write('mode-4-dates.map')
 
 # go back over data and write tensor
 write_ratings(rating_fname, 'movielens20m-ratings.tns')
@@ -4,6 +4,11 @@ import os, sys
 
 from collections import defaultdict
 
+sys.path.append('../')
+sys.path.append('../../utilities')
+from id_map import IDMap
+from tensor_writer import open_tensor
+
 # paper x author x word x year = count
 
 WORDS='words.txt'
@@ -14,16 +19,10 @@ COUNTS='counts.ijv'
 DOC_AUTHORS='doc_authors.ijv'
 
 
-def assign_id(dic, item):
-  if item not in dic:
-    dic[item] = len(dic) + 1
-
-
-
-word_ids   = {}
-author_ids = {}
-year_ids   = {}
-doc_ids    = {}
+word_ids   = IDMap()
+author_ids = IDMap()
+year_ids   = IDMap()
+doc_ids    = IDMap()
 
 
 doc_years = {}
@@ -32,7 +31,7 @@ doc_years = {}
 # parse word ids
 with open(WORDS, 'r') as fin:
   for line in fin:
-    assign_id(word_ids, line.strip())
+    word_ids.assign(line.strip())
 
 print('words: {:,d}'.format(len(word_ids)))
 
@@ -40,7 +39,7 @@ print('words: {:,d}'.format(len(word_ids)))
 # parse author ids
 with open(AUTHORS, 'r') as fin:
   for line in fin:
-    assign_id(author_ids, line.strip())
+    author_ids.assign(line.strip())
 print('authors: {:,d}'.format(len(author_ids)))
 
 
@@ -49,10 +48,7 @@ with open(DOC_NAMES, 'r') as fin:
   for line in fin:
     line = line.strip()
     year = line.split('/')[0]
-    assign_id(year_ids, year)
-    assign_id(doc_ids, line)
-
-    doc_years[doc_ids[line]] = year_ids[year]
+    doc_years[doc_ids.assign(line)] = year_ids.assign(year)
 
 print('papers: {:,d}'.format(len(doc_ids)))
 print('years: {:,d}'.format(len(year_ids)))
@@ -77,7 +73,7 @@ with open(DOC_AUTHORS, 'r') as fin:
 
 # generate nnz
 nnz = 1
-fout = open('nips.tns', 'w')
+fout = open_tensor('nips.tns', 4, value_type='q')
 with open(COUNTS, 'r') as fin:
   for line in fin:
     line = line.strip().split()
@@ -92,9 +88,10 @@ with open(COUNTS, 'r') as fin:
     year = doc_years[doc]
 
     for auth in author_list[doc]:
-      print('{} {} {} {} {}'.format(doc, auth, word, year, count), file=fout)
+      fout.write(doc, auth, word, year, count)
       nnz += 1
 fout.close()
+print(fout.report())
 print('nnz: {:,d}'.format(nnz))
 
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+##############################################################################
+# Benchmark comment decoding on synthetic Reddit comment lines.
+#
+# Checks that the selective scanner of comment_json.py decodes the same
+# author, subreddit, timestamp, and body as the json module, then reports
+# comments/s for each backend.
+##############################################################################
+
+import sys
+import json
+import time
+import random
+import string
+
+import comment_json
+
+
+if len(sys.argv) > 2:
+  print('usage: {} [#comments]'.format(sys.argv[0]))
+  sys.exit(1)
+
+NCOMMENTS = int(sys.argv[1]) if len(sys.argv) == 2 else 200000
+
+
+def make_body(rng, vocab):
+  '''
+    A body with the characters JSON must escape: quotes, backslashes,
+    newlines, non-ASCII text, and the odd quoted field name.
+  '''
+  words = rng.choices(vocab, k=rng.randint(3, 120))
+  for i in range(len(words)):
+    r = rng.random()
+    if r < 0.02:
+      words[i] = '"' + words[i] + '"'
+    elif r < 0.03:
+      words[i] += '\n\n'
+    elif r < 0.035:
+      words[i] += '’s'
+    elif r < 0.037:
+      words[i] = rng.choice(['"author":', '"body": x', '\\', '\\"subreddit\\"'])
+  return ' '.join(words)
+
+
+def make_comments(ncomments, seed=1):
+  '''
+    Comment lines with the fields and layout of the 2015 dumps. Timestamps
+    are strings in older dumps and integers in newer ones, so both are made.
+  '''
+  rng = random.Random(seed)
+  vocab = [''.join(rng.choice(string.ascii_lowercase)
+      for _ in range(rng.randint(1, 12))) for _ in range(20000)]
+  subs = ['sub{}'.format(i) for i in range(500)]
+
+  lines = []
+  for i in range(ncomments):
+    utc = 1420070668 + rng.randint(0, 2678400)
+    comment = {
+      'gilded': 0,
+      'author_flair_text': rng.choice([None, 'Male', 'author']),
+      'author_flair_css_class': None,
+      'retrieved_on': utc + 5000000,
+      'ups': rng.randint(-10, 500),
+      'subreddit_id': 't5_2s30g',
+      'edited': False,
+      'controversiality': 0,
+      'parent_id': 't1_cnapn0k',
+      'subreddit': rng.choice(subs),
+      'body': make_body(rng, vocab),
+      'created_utc': str(utc) if rng.random() < 0.5 else utc,
+      'downs': 0,
+      'score': 3,
+      'author': rng.choice(['[deleted]', 'user{}'.format(rng.randint(0, 99999))]),
+      'archived': False,
+      'distinguished': None,
+      'id': 'c{}'.format(i),
+      'score_hidden': False,
+      'name': 't1_c{}'.format(i),
+      'link_id': 't3_2qyhmp',
+    }
+    lines.append(json.dumps(comment, ensure_ascii=rng.random() < 0.5,
+        separators=(',', ':')) + '\n')
+  return lines
+
+
+def bench(name, decode, lines, nbytes):
+  start = time.perf_counter()
+  for line in lines:
+    decode(line)
+  secs = time.perf_counter() - start
+  print('{:<8s} {:8.3f}s  {:12,.0f} comments/s  {:8.1f} MB/s'.format(
+      name, secs, len(lines) / secs, nbytes / secs / 1e6))
+  return secs
+
+
+lines = make_comments(NCOMMENTS)
+nbytes = sum(len(line) for line in lines)
+print('{:,d} comments, {:,.1f} MB'.format(len(lines), nbytes / 1e6))
+
+scan = comment_json.get_decoder('scan')
+for line in lines:
+  full = json.loads(line)
+  fields = scan(line)
+  if any(fields[key] != full[key] for key in comment_json.FIELDS):
+    print('MISMATCH: {!r}'.format(line))
+    sys.exit(1)
+
+json_secs = bench('json', comment_json.get_decoder('json'), lines, nbytes)
+scan_secs = bench('scan', scan, lines, nbytes)
+print('speedup: {:0.2f}x'.format(json_secs / scan_secs))
+if comment_json.orjson is not None:
+  orjson_secs = bench('orjson', comment_json.get_decoder('orjson'), lines,
+      nbytes)
+  print('speedup: {:0.2f}x'.format(json_secs / orjson_secs))
+else:
+  print('orjson is not installed')
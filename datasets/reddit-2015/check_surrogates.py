@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+##############################################################################
+# Check that comments holding lone surrogates build end to end.
+#
+# Truncated emoji leave escapes such as "\ud83d" in the Reddit dumps, which
+# decode to lone surrogates that UTF-8 cannot encode. This builds a small
+# synthetic corpus full of them, with every count above the pruning
+# thresholds, once in memory and once with MAX_MEM_KEYS spilling, and checks
+# that both builds succeed, write valid UTF-8 maps, and agree.
+##############################################################################
+
+import os
+import sys
+import bz2
+import json
+import random
+import filecmp
+import tempfile
+
+import parse_reddit
+
+
+OUTPUTS = ('mode-1-dates.map', 'mode-2-users.map', 'mode-3-subreddits.map',
+    'mode-4-words.map', 'users.counts', 'subreddits.counts', 'words.counts',
+    'reddit4.tns', 'reddit3.tns')
+
+
+def make_corpus(fname, ncomments, seed):
+  '''
+    Comment lines whose bodies repeat a few words, with and without lone
+    surrogates glued to them, written with ASCII escapes like the dumps.
+  '''
+  rng = random.Random(seed)
+  words = ['smile', 'grin', 'wave', 'heart']
+  with bz2.open(fname, 'wt') as fout:
+    for i in range(ncomments):
+      body = ' '.join(rng.choice(words) + rng.choice(['', '\ud83d', '\udc4d'])
+          for _ in range(rng.randint(1, 10)))
+      comment = {
+        'subreddit': 'sub{}'.format(rng.randint(0, 3)),
+        'body': body + rng.choice(['', ' \ud83d']),
+        'created_utc': str(1420070668 + rng.randint(0, 86400 * 3)),
+        'author': 'user{}'.format(rng.randint(0, 9)),
+      }
+      fout.write(json.dumps(comment) + '\n')
+
+
+def build(infiles, max_mem_keys):
+  '''
+    Run both stages of parse_reddit.py on infiles in the current directory.
+  '''
+  parse_reddit.MAX_MEM_KEYS = max_mem_keys
+  counts = parse_reddit.new_totals()
+  shards = parse_reddit.shard_paths(infiles)
+  for infile, (ids_fname, counts_fname) in zip(infiles, shards):
+    parse_reddit.merge_counts(counts,
+        parse_reddit.parse_file(infile, ids_fname, counts_fname, 1))
+  parse_reddit.build_tensors(counts, shards)
+
+
+parse_reddit.CHECKPOINT_DIR = None
+parse_reddit.READ_AHEAD = 0
+
+with tempfile.TemporaryDirectory(prefix='surrogates-') as tmp:
+  infiles = []
+  for i in range(2):
+    infiles.append(os.path.join(tmp, 'RC_{}.bz2'.format(i)))
+    make_corpus(infiles[-1], 500, i)
+
+  builds = []
+  for max_mem_keys in (0, 3):
+    outdir = os.path.join(tmp, 'keys-{}'.format(max_mem_keys))
+    os.mkdir(outdir)
+    os.chdir(outdir)
+    build(infiles, max_mem_keys)
+    builds.append(outdir)
+
+    for fname in OUTPUTS:
+      with open(fname, 'rb') as fin:
+        text = fin.read().decode('utf-8', 'surrogatepass')
+      if any('\ud800' <= c <= '\udfff' for c in text):
+        print('FAILED: {} holds a surrogate'.format(fname))
+        sys.exit(1)
+
+  os.chdir(tmp)
+  match, mismatch, errors = filecmp.cmpfiles(builds[0], builds[1], OUTPUTS,
+      shallow=False)
+  if mismatch or errors:
+    print('FAILED: the builds differ in {}'.format(', '.join(mismatch + errors)))
+    sys.exit(1)
+
+print('OK: lone surrogates build in memory and with MAX_MEM_KEYS')
@@ -0,0 +1,131 @@
+
+##############################################################################
+# Decode only the fields of a Reddit comment that the tensor needs.
+#
+# A comment line carries some twenty fields, but parse_reddit.py only reads
+# the author, subreddit, timestamp, and body. Fully decoding each line builds
+# a dict (and a str for every key and value) only to throw most of it away.
+#
+# scan_fields() instead finds each wanted key with str.find() and decodes
+# just its value, with the C string scanner of the json module. It relies
+# on the wanted keys being top-level and unique, as they are in the Reddit
+# dumps; a key that cannot be found or a value that is not a string or a
+# number falls back to a full decode.
+#
+# get_decoder() selects between this scanner ('scan'), the json module
+# ('json'), and orjson ('orjson'), if it is installed. orjson decodes every
+# field, but in C, and is faster still; 'auto' uses it when it is available
+# and the scanner otherwise. orjson rejects some JSON that the json module
+# accepts, such as the lone surrogate escapes of truncated emoji, so lines
+# it rejects are decoded again with the json module.
+##############################################################################
+
+import json
+from json.decoder import WHITESPACE, scanstring
+from json.scanner import NUMBER_RE
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+
+# in the order they appear in the 2015 dumps, which scan_fields() exploits
+FIELDS = ('subreddit', 'body', 'created_utc', 'author')
+
+
+def find_value(line, key):
+  '''
+    Return the index of the value of key in a JSON object line, or -1.
+  '''
+  pattern = '"' + key + '"'
+  pos = line.find(pattern)
+  while pos >= 0:
+    end = WHITESPACE.match(line, pos + len(pattern)).end()
+    # a quoted key is followed by ':'; an equal string value never is
+    if line[end:end+1] == ':':
+      return WHITESPACE.match(line, end + 1).end()
+    pos = line.find(pattern, pos + 1)
+  return -1
+
+
+def scan_fields(line, fields=FIELDS):
+  '''
+    Decode only the given fields of a JSON object line into a dict. Returns
+    None if a field is missing or its value is not a string or a number.
+  '''
+  comment = {}
+  start = 0
+  try:
+    for key in fields:
+      # The dumps are compact, so the key is usually followed by ':' at once.
+      # Search after the previous value first: keys in the expected order
+      # are then found without rescanning the long body.
+      pattern = '"' + key + '":'
+      pos = line.find(pattern, start)
+      if pos < 0:
+        pos = line.find(pattern)
+      if pos >= 0:
+        pos += len(pattern)
+        if line[pos] in ' \t\n\r':
+          pos = WHITESPACE.match(line, pos).end()
+      else:
+        pos = find_value(line, key)
+        if pos < 0:
+          return None
+
+      if line[pos] == '"':
+        comment[key], start = scanstring(line, pos + 1)
+        continue
+      match = NUMBER_RE.match(line, pos)
+      if match is None:
+        return None
+      integer, frac, exp = match.groups()
+      if frac or exp:
+        comment[key] = float(integer + (frac or '') + (exp or ''))
+      else:
+        comment[key] = int(integer)
+      start = match.end()
+  except (ValueError, IndexError):
+    return None
+  return comment
+
+
+def decode_fields(line):
+  '''
+    scan_fields(), falling back to the json module for lines it cannot
+    scan. The fallback returns every field.
+  '''
+  comment = scan_fields(line)
+  if comment is None:
+    comment = json.loads(line)
+  return comment
+
+
+def orjson_fields(line):
+  '''
+    orjson.loads(), falling back to the json module for lines orjson
+    rejects.
+  '''
+  try:
+    return orjson.loads(line)
+  except orjson.JSONDecodeError:
+    return json.loads(line)
+
+
+def get_decoder(backend='auto'):
+  '''
+    Return a function which decodes one comment line into a dict holding at
+    least FIELDS.
+  '''
+  if backend == 'auto':
+    backend = 'scan' if orjson is None else 'orjson'
+  if backend == 'scan':
+    return decode_fields
+  if backend == 'json':
+    return json.JSONDecoder().decode
+  if backend == 'orjson':
+    if orjson is None:
+      raise ImportError('the orjson backend requires orjson to be installed')
+    return orjson_fields
+  raise ValueError('unknown JSON backend: {}'.format(backend))
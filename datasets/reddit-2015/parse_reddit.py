@@ -4,17 +4,24 @@
 import os
 import sys
 sys.path.append('../')
+sys.path.append('../../utilities')
 
 import text_parser
+from id_map import IDMap, KeyCounter
+from external_ids import SpillCounter
+from reduce_nnz import ProjectionWriter
+from read_ahead import ReadAhead
+from comment_json import get_decoder
+from reddit_shards import COLUMNS, ShardWriter, shard_fnames, \
+    checkpoint_fnames, source_key, save_counts, read_source, load_counts, \
+    lookup_arrays, remap_rows
 
 import bz2
-import json
+import itertools
 
 
 import datetime
 
-from collections import defaultdict, Counter
-
 
 ##############################################################################
 # CONSTANTS - EDIT THESE FOR YOUR OWN SETUP
@@ -25,6 +32,45 @@ WORD_MIN = 5
 WORD_MAX = -1
 
 TMP_FILE = "tmp"
+
+# Directory of per-file checkpoints: the intermediate shard and counts of
+# each input file (see reddit_shards.py), kept after the run. Files whose
+# checkpoint is up to date are not parsed again, so a crashed run resumes
+# where it stopped and adding a month only parses the new file.
+# parse_stage2.py rebuilds the maps and tensors from the checkpoints alone.
+# None parses every file into temporary shards instead.
+CHECKPOINT_DIR = "checkpoints"
+
+# stems shared with other dataset builds (set to None to disable)
+STEM_TABLE = "../stems.table"
+
+# processes used to tokenize comment bodies
+NUM_WORKERS = os.cpu_count()
+
+# Processes that each parse whole input files. With more than one, every
+# file is parsed (and tokenized) in its own process and the per-file counts
+# are merged afterwards; NUM_WORKERS is then unused.
+FILE_WORKERS = 1
+
+# Maximum number of distinct users (and words) counted in memory before
+# spilling to disk. 0 keeps everything in memory. This bounds the totals over
+# all files; the keys of the file being parsed are always held in memory.
+MAX_MEM_KEYS = 0
+
+# How comments are decoded: 'scan' decodes just the fields used below, 'json'
+# and 'orjson' decode every field, and 'auto' picks orjson if it is installed
+# and the scanner otherwise (see comment_json.py)
+JSON_BACKEND = 'auto'
+
+# Batches of lines decompressed on a background thread ahead of parsing, so
+# that the two overlap (0 decompresses and parses in turn). Each file's read
+# report shows which of the two waits on the other.
+READ_AHEAD = 8
+
+# Threads that decompress the bz2 blocks of a file in parallel (see
+# read_ahead.py). Worth raising on spare cores if the read report shows
+# parsing waiting on decompression.
+DECOMPRESS_THREADS = 1
 ##############################################################################
 
 
@@ -55,166 +101,289 @@ Sample comment (in JSON):
 }
 '''
 
-def get_id(dic, item):
-  if item not in dic:
-    dic[item] = 1 + len(dic)
-  return dic[item]
+def read_comments(lines):
+  '''
+    Decode each comment line, skipping deleted comments.
+  '''
+  for line in lines:
+    comment = decode(line)
+    if comment['author'] == '[deleted]':
+      continue
+    yield comment
 
 
-def write_ids(fname, dic):
-  # invert dictionary first
-  inv = {}
-  for x in dic.keys():
-    inv[dic[x]] = x
+def assign_ids(counts, keep, counts_fname):
+  '''
+    Write "count key" lines for the keys whose count passes keep() and give
+    them IDs in order of first appearance.
+  '''
+  if isinstance(counts, SpillCounter):
+    return counts.assign_ids(keep, counts_fname=counts_fname)
 
-  with open(fname, 'w') as f:
-    for i in range(1, len(dic)+1):
-      f.write('{}\n'.format(inv[i]))
+  ids = IDMap()
+  with open(counts_fname, 'w') as fout:
+    for key, count in counts.items():
+      if keep(count):
+        fout.write('{} {}\n'.format(count, key))
+        ids.assign(key)
+  return ids
 
 
 # convert UTC to day resolution
 def convert_utc(utc_str):
   return str(datetime.date.fromtimestamp(int(utc_str)))
 
-user_counts = Counter()
-sub_counts  = Counter()
-word_counts = Counter()
-
-dates = {}
-
-if len(sys.argv) == 1:
-  print('usage: {} <comment bz2 files>'.format(sys.argv[0]))
-  sys.exit(1)
-
-decoder = json.JSONDecoder()
-
-ncomments = 0
-nwords = 0
-
-outfile = bz2.open(TMP_FILE + '.bz2', 'wt')
-
-for infile in sys.argv[1:]:
-  print('parsing {}'.format(infile))
-  bfile = bz2.open(infile, 'rt')
-
-  # decode each comment into a JSON object
-  for line in bfile:
-    comment = decoder.decode(line)
-
-    # parse user, skipping deleted comments
-    user = comment['author']
-    if user == '[deleted]':
-      continue
-
-    sub = comment['subreddit']
-    timestamp = convert_utc(int(comment['created_utc']))
-
-    # increment counters
-    user_counts[user] += 1
-    sub_counts[sub] += 1
-    dates[timestamp] = 1
-
-    text = comment['body']
-    for word in text_parser.parse_text(text):
-      word_counts[word] += 1
-      nwords += 1
-
-      outfile.write('{} {} {} {}\n'.format(user, sub, word, timestamp))
-
-    ncomments += 1
-
-  bfile.close()
-
-  # WARNING - delete input file
-  # s.remove(infile)
-
-outfile.close()
-
-print(user_counts.most_common(10))
-print(sub_counts.most_common(10))
-print(word_counts.most_common(10))
-
-user_ids = {}
-sub_ids  = {}
-word_ids = {}
-
-#
-# write counts and assign unique IDs (after pruning infrequent/frequent)
-#
-
-# assign time IDs so they are sorted
-uniques = sorted(dates.keys())
-dates = {}
-for i in range(len(uniques)):
-  dates[uniques[i]] = i + 1
-del uniques
-
-with open('users.counts', 'w') as user_file:
-  for u in user_counts:
-    if user_counts[u] >= USER_MIN:
-      user_file.write('{} {}\n'.format(user_counts[u], u))
-      get_id(user_ids, u)
-del user_counts
-
-
-with open('subreddits.counts', 'w') as sub_file:
-  for u in sub_counts:
-    if sub_counts[u] >= SUB_MIN:
-      sub_file.write('{} {}\n'.format(sub_counts[u], u))
-      get_id(sub_ids, u)
-del sub_counts
-
-
-with open('words.counts', 'w') as word_file:
-  for u in word_counts:
-    if word_counts[u] >= WORD_MIN and (WORD_MAX == -1 or word_counts[u] <= WORD_MAX):
-      word_file.write('{} {}\n'.format(word_counts[u], u))
-      get_id(word_ids, u)
-del word_counts
-
-write_ids('mode-1-dates.map', dates)
-write_ids('mode-2-users.map', user_ids)
-write_ids('mode-3-subreddits.map', sub_ids)
-write_ids('mode-4-words.map', word_ids)
-
-print('comments: {:,d} (avg length: {:0.2f})'.format(ncomments, float(nwords) / float(ncomments)))
-print('users: {:,d}'.format(len(user_ids)))
-print('subreddits: {:,d}'.format(len(sub_ids)))
-print('words: {:,d}'.format(len(word_ids)))
-print('dates: {:,d}'.format(len(dates)))
-
-#
-# Finally, go back over original input and write tensor nonzeros
-#
-t3file = open('reddit3.tns', 'w')
-t4file = open('reddit4.tns', 'w')
-nnz = 0
-pruned = 0
-
-with bz2.open(TMP_FILE + '.bz2', 'rt') as bfile:
-
-  for line in bfile:
-    comment = line.split()
-
-    uid = get_id(user_ids, comment[0])
-    sid = get_id(sub_ids, comment[1])
-    wid = get_id(word_ids, comment[2])
-    tid = get_id(dates, comment[3])
-
-    if uid is None or sid is None or tid is None or wid is None:
-      pruned += 1
-      continue
-
-    print('{} {} {} 1'.format(uid, sid, wid), file=t3file)
-    print('{} {} {} {} 1'.format(tid, uid, sid, wid), file=t4file)
-    nnz += 1
-
-t3file.close()
-t4file.close()
-os.remove(TMP_FILE + '.bz2')
-
-print('nnz: {:,d}'.format(nnz))
-print('pruned: {:,d}'.format(pruned))
-
-
 
+def new_counts(user_counts=None, word_counts=None):
+  return {
+    'users': KeyCounter() if user_counts is None else user_counts,
+    'subreddits': KeyCounter(),
+    'words': KeyCounter() if word_counts is None else word_counts,
+    'dates': KeyCounter(),
+    'comments': 0,
+    'tokens': 0,
+  }
+
+
+def merge_counts(counts, part):
+  '''
+    Add the counts of one file into the running totals. Merging in input
+    order keeps the first-appearance order that IDs are assigned in.
+  '''
+  for name in COLUMNS:
+    counts[name].update(part[name])
+  counts['comments'] += part['comments']
+  counts['tokens'] += part['tokens']
+
+
+def parse_file(infile, ids_fname, counts_fname, nworkers):
+  '''
+    Count the users, subreddits, words, and dates of one comment file, and
+    write its "user subreddit word date" rows to a shard (see
+    reddit_shards.py). Returns the file's counts, which are also saved to
+    counts_fname: their IDs are the ones in the shard.
+  '''
+  source = source_key(infile)
+  # invalidate the old checkpoint until this one is complete
+  if os.path.exists(counts_fname):
+    os.remove(counts_fname)
+
+  counts = new_counts()
+  users = counts['users']
+  subs = counts['subreddits']
+  words = counts['words']
+  dates = counts['dates']
+
+  if READ_AHEAD:
+    infile_lines = ReadAhead(infile, depth=READ_AHEAD,
+        workers=DECOMPRESS_THREADS)
+  else:
+    infile_lines = bz2.open(infile, 'rt')
+
+  with ShardWriter(ids_fname) as shard, infile_lines as lines:
+    # tokenize bodies in worker processes while we walk the comments in order
+    comments, bodies = itertools.tee(read_comments(lines))
+    bodies = (comment['body'] for comment in bodies)
+    token_lists = text_parser.parse_texts(bodies, nworkers)
+
+    for comment, tokens in zip(comments, token_lists):
+      uid = users.add(comment['author'])
+      sid = subs.add(comment['subreddit'])
+      tid = dates.add(convert_utc(int(comment['created_utc'])))
+      shard.write(uid, sid, words.add_many(tokens), tid)
+
+      counts['tokens'] += len(tokens)
+      counts['comments'] += 1
+
+  if READ_AHEAD:
+    print(lines.report())
+  save_counts(counts_fname, counts, source)
+  return counts
+
+
+def parse_file_job(job):
+  '''
+    Parse one file in a FILE_WORKERS process. The parent merges the counts
+    saved to counts_fname, and records the stems that are new since the
+    worker last flushed them.
+  '''
+  infile, ids_fname, counts_fname = job
+  parse_file(infile, ids_fname, counts_fname, 1)
+  return counts_fname, text_parser.take_new_stems()
+
+
+def shard_paths(infiles):
+  '''
+    The (ids, counts) file names of the shard of each input file.
+  '''
+  if CHECKPOINT_DIR is None:
+    return [shard_fnames(TMP_FILE, i) for i in range(len(infiles))]
+
+  os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+  shards = [checkpoint_fnames(CHECKPOINT_DIR, infile) for infile in infiles]
+  if len(set(shards)) != len(shards):
+    print('input files must have distinct names to be checkpointed')
+    sys.exit(1)
+  return shards
+
+
+def up_to_date(infile, ids_fname, counts_fname):
+  '''
+    True if the checkpoint of infile is complete and infile is unchanged.
+  '''
+  return CHECKPOINT_DIR is not None and os.path.exists(ids_fname) and \
+      read_source(counts_fname) == source_key(infile)
+
+
+def build_tensors(counts, shards):
+  '''
+    Prune the merged counts of all files, write the maps, and remap the
+    shards into the tensors. The counts are consumed.
+  '''
+  user_counts = counts.pop('users')
+  sub_counts = counts.pop('subreddits')
+  word_counts = counts.pop('words')
+  dates = counts.pop('dates')
+  ncomments = counts['comments']
+  nwords = counts['tokens']
+
+  print(user_counts.most_common(10))
+  print(sub_counts.most_common(10))
+  print(word_counts.most_common(10))
+
+  #
+  # write counts and assign unique IDs (after pruning infrequent/frequent)
+  #
+
+  # assign time IDs so they are sorted
+  dates = IDMap.sorted(dates)
+
+  user_ids = assign_ids(user_counts, lambda c: c >= USER_MIN, 'users.counts')
+  del user_counts
+
+  sub_ids = assign_ids(sub_counts, lambda c: c >= SUB_MIN, 'subreddits.counts')
+  del sub_counts
+
+  word_ids = assign_ids(word_counts,
+      lambda c: c >= WORD_MIN and (WORD_MAX == -1 or c <= WORD_MAX),
+      'words.counts')
+  del word_counts
+
+  dates.write('mode-1-dates.map')
+  user_ids.write('mode-2-users.map')
+  sub_ids.write('mode-3-subreddits.map')
+  word_ids.write('mode-4-words.map')
+
+  print('comments: {:,d} (avg length: {:0.2f})'.format(ncomments, float(nwords) / float(ncomments)))
+  print('users: {:,d} ({:,d} bytes)'.format(len(user_ids), user_ids.nbytes()))
+  print('subreddits: {:,d} ({:,d} bytes)'.format(len(sub_ids), sub_ids.nbytes()))
+  print('words: {:,d} ({:,d} bytes)'.format(len(word_ids), word_ids.nbytes()))
+  print('dates: {:,d}'.format(len(dates)))
+
+  #
+  # Finally, go back over the shards and write tensor nonzeros. The 3D
+  # tensor drops the date mode, summing the counts of merged nonzeros.
+  #
+  tfile = ProjectionWriter('reddit4.tns', 4,
+      [((1, 2, 3), 'reddit3.tns', 'sum')], value_type='q')
+  nnz = 0
+  pruned = 0
+
+  # Look up all four IDs in bulk; pruned keys have ID 0. Each shard's counts
+  # list its keys in the order of the IDs in its rows. Spilled maps look up
+  # the keys of every shard in one pass over their tables; in-memory maps
+  # look each shard up as it comes, from the counts loaded last.
+  loaded = {}
+  def shard_keys(name):
+    for ids_fname, counts_fname in shards:
+      if counts_fname not in loaded:
+        loaded.clear()
+        loaded[counts_fname] = load_counts(counts_fname)
+      yield loaded[counts_fname][name]
+
+  maps = (user_ids, sub_ids, word_ids, dates)
+  shard_lookups = zip(*[lookup_arrays(ids, shard_keys(name))
+      for ids, name in zip(maps, COLUMNS)])
+  for (ids_fname, counts_fname), lookups in zip(shards, shard_lookups):
+    for (uids, sids, wids, tids), npruned in remap_rows(ids_fname, lookups):
+      tfile.write_columns([tids.tolist(), uids.tolist(), sids.tolist(),
+          wids.tolist()], [1] * len(uids))
+      nnz += len(uids)
+      pruned += npruned
+
+  tfile.close()
+  if CHECKPOINT_DIR is None:
+    for ids_fname, counts_fname in shards:
+      os.remove(ids_fname)
+      os.remove(counts_fname)
+  print(tfile.report())
+
+  print('nnz: {:,d}'.format(nnz))
+  print('pruned: {:,d}'.format(pruned))
+
+
+def new_totals():
+  '''
+    Empty counts to merge every file into, spilling if MAX_MEM_KEYS is set.
+  '''
+  if MAX_MEM_KEYS:
+    return new_counts(SpillCounter(MAX_MEM_KEYS, tmpdir='.'),
+        SpillCounter(MAX_MEM_KEYS, tmpdir='.'))
+  return new_counts()
+
+
+decode = get_decoder(JSON_BACKEND)
+
+if __name__ == '__main__':
+  if len(sys.argv) == 1:
+    print('usage: {} <comment bz2 files>'.format(sys.argv[0]))
+    sys.exit(1)
+
+  if STEM_TABLE:
+    print('stem table: {:,d} stems'.format(text_parser.load_stem_table(STEM_TABLE)))
+
+  counts = new_totals()
+
+  # one intermediate shard per input file, read back in input order
+  infiles = sys.argv[1:]
+  shards = shard_paths(infiles)
+  stale = [not up_to_date(infile, *shard) for infile, shard in
+      zip(infiles, shards)]
+
+  if FILE_WORKERS > 1 and any(stale):
+    import multiprocessing
+
+    # load NLTK once so that the forked workers inherit it
+    text_parser.get_stemmer()
+    jobs = [(infile, ids_fname, counts_fname) for infile, (ids_fname,
+        counts_fname), parse in zip(infiles, shards, stale) if parse]
+    pool = multiprocessing.Pool(FILE_WORKERS)
+    parsed = pool.imap(parse_file_job, jobs)
+  else:
+    pool = None
+
+  # merge in input order, whichever files were parsed
+  for infile, (ids_fname, counts_fname), parse in zip(infiles, shards, stale):
+    if not parse:
+      print('up to date: {}'.format(infile))
+      merge_counts(counts, load_counts(counts_fname))
+    elif pool is not None:
+      text_parser.add_stems(next(parsed)[1])
+      print('parsed {}'.format(infile))
+      merge_counts(counts, load_counts(counts_fname))
+    else:
+      print('parsing {}'.format(infile))
+      merge_counts(counts,
+          parse_file(infile, ids_fname, counts_fname, NUM_WORKERS))
+
+      # WARNING - delete input file
+      # s.remove(infile)
+
+  if pool is not None:
+    pool.close()
+    pool.join()
+
+  text_parser.close_stem_table()
+  print('stem cache: {}'.format(text_parser.stem_cache_info()))
+
+  build_tensors(counts, shards)
@@ -2,75 +2,55 @@
 
 
 import os
-import bz2
-
-
-##############################################################################
-# CONSTANTS - EDIT THESE FOR YOUR OWN SETUP
-
-TMP_FILE = "tmp"
-
-##############################################################################
-
-
-def get_id(dic, item):
-  if item not in dic:
-    return None
-  return dic[item]
-
-
-def read_ids(fname, fn):
-  nbr = 1
-  ids = dict()
-  with open(fname, 'r') as infile:
-    for line in infile:
-      ids[fn(line.strip())] = nbr
-      nbr += 1
-  return ids
-
-
-# read ids
-user_ids = read_ids('users.txt', str)
-sub_ids  = read_ids('subreddits.txt', str)
-word_ids = read_ids('words.txt', str)
-dates    = read_ids('dates.txt', int)
-
-print('users: {:,d}'.format(len(user_ids)))
-print('subreddits: {:,d}'.format(len(sub_ids)))
-print('words: {:,d}'.format(len(word_ids)))
-print('dates: {:,d}'.format(len(dates)))
-
-
-#
-# Finally, go back over original input and write tensor nonzeros
-#
-t3file = open('reddit3.tns', 'w')
-t4file = open('reddit4.tns', 'w')
-nnz = 0
-pruned = 0
-
-with bz2.open(TMP_FILE + '.bz2', 'rt') as bfile:
-
-  for line in bfile:
-    comment = line.split()
-
-    uid = get_id(user_ids, comment[0])
-    sid = get_id(sub_ids, comment[1])
-    wid = get_id(word_ids, comment[2])
-    tid = get_id(dates, int(comment[3]))
-
-    if uid is None or sid is None or tid is None or wid is None:
-      pruned += 1
-      continue
-
-    print('{} {} {} 1'.format(uid, sid, wid), file=t3file)
-    print('{} {} {} {} 1'.format(uid, sid, wid, tid), file=t4file)
-    nnz += 1
-
-t3file.close()
-t4file.close()
-os.remove(TMP_FILE + '.bz2')
-
-print('nnz: {:,d}'.format(nnz))
-print('pruned: {:,d}'.format(pruned))
-
+import sys
+import glob
+
+sys.path.append('../')
+sys.path.append('../../utilities')
+from reddit_shards import checkpoint_fnames, read_source, source_key, \
+    load_counts
+from parse_reddit import CHECKPOINT_DIR, new_totals, merge_counts, \
+    build_tensors
+
+
+'''
+Rebuild the maps and tensors of parse_reddit.py from its checkpoints alone,
+without parsing any comments (e.g., after changing USER_MIN, SUB_MIN,
+WORD_MIN, or WORD_MAX in parse_reddit.py).
+
+Checkpoints are merged in the order of the comment files given, which must
+be the order parse_reddit.py was given them for the IDs to match. Without
+arguments, every checkpoint is merged in name order, which is date order for
+the RC_YYYY-MM files.
+'''
+
+
+if CHECKPOINT_DIR is None:
+  print('parse_reddit.py keeps no checkpoints (CHECKPOINT_DIR is None)')
+  sys.exit(1)
+
+if len(sys.argv) > 1:
+  shards = []
+  for infile in sys.argv[1:]:
+    ids_fname, counts_fname = checkpoint_fnames(CHECKPOINT_DIR, infile)
+    source = read_source(counts_fname)
+    # input files may have been deleted since they were parsed
+    if source is None or not os.path.exists(ids_fname) or \
+        (os.path.exists(infile) and source != source_key(infile)):
+      print('{}: no up-to-date checkpoint; run parse_reddit.py'.format(infile))
+      sys.exit(1)
+    shards.append((ids_fname, counts_fname))
+else:
+  shards = [(fname[:-len('.counts')] + '.ids', fname) for fname in
+      sorted(glob.glob(os.path.join(CHECKPOINT_DIR, '*.counts')))]
+
+if not shards:
+  print('no checkpoints in {}'.format(CHECKPOINT_DIR))
+  sys.exit(1)
+
+counts = new_totals()
+for ids_fname, counts_fname in shards:
+  print('merging {}'.format(counts_fname))
+  merge_counts(counts, load_counts(counts_fname))
+
+build_tensors(counts, shards)
@@ -0,0 +1,153 @@
+
+##############################################################################
+# Integer-coded intermediate shards of parse_reddit.py.
+#
+# Stage 1 writes one shard per input file:
+#
+#   tmp-NNNN.ids      one "user subreddit word date" row per token, as
+#                     native uint32 IDs local to the file
+#   tmp-NNNN.counts   pickle of the file's counts, whose KeyCounters (see
+#                     id_map.py) list the keys in local ID order
+#
+# Shards double as checkpoints, named after their input file. The .counts
+# file starts with the source key (path, size, and mtime) of the input file,
+# and is written last, in one rename: a shard whose source key matches its
+# input file is complete and up to date.
+#
+# Stage 2 turns each KeyCounter into a lookup array from local to final IDs,
+# with 0 for pruned keys, and remaps the rows a block at a time with NumPy.
+# Keys are hashed once per file rather than once per token.
+##############################################################################
+
+import os
+import pickle
+from array import array
+
+import numpy as np
+
+
+# the counts holding the keys of each column of a row
+COLUMNS = ('users', 'subreddits', 'words', 'dates')
+
+
+def shard_fnames(tmp_file, i):
+  '''
+    The (ids, counts) file names of shard i.
+  '''
+  prefix = '{}-{:04d}'.format(tmp_file, i)
+  return prefix + '.ids', prefix + '.counts'
+
+
+class ShardWriter:
+  '''
+    Buffers rows of local IDs and appends them to a .ids file.
+  '''
+
+  def __init__(self, fname, block=1 << 18):
+    self.fout = open(fname, 'wb')
+    self.rows = array('I')
+    self.block = block * len(COLUMNS)
+
+  def write(self, uid, sid, wids, tid):
+    '''
+      Write one row per word ID of a comment.
+    '''
+    rows = self.rows
+    for wid in wids:
+      rows.extend((uid, sid, wid, tid))
+    if len(rows) >= self.block:
+      self.flush()
+
+  def flush(self):
+    self.rows.tofile(self.fout)
+    self.rows = array('I')
+
+  def close(self):
+    self.flush()
+    self.fout.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+def checkpoint_fnames(dirname, infile):
+  '''
+    The (ids, counts) file names of the checkpoint of infile in dirname.
+  '''
+  prefix = os.path.join(dirname, os.path.basename(infile))
+  return prefix + '.ids', prefix + '.counts'
+
+
+def source_key(infile):
+  '''
+    Identifies an input file and its contents: (path, size, mtime).
+  '''
+  st = os.stat(infile)
+  return os.path.abspath(infile), st.st_size, st.st_mtime_ns
+
+
+def save_counts(fname, counts, source=None):
+  '''
+    Save counts, preceded by the source key of the file they come from.
+  '''
+  with open(fname + '.part', 'wb') as fout:
+    pickle.dump(source, fout, pickle.HIGHEST_PROTOCOL)
+    pickle.dump(counts, fout, pickle.HIGHEST_PROTOCOL)
+  os.replace(fname + '.part', fname)
+
+
+def read_source(fname):
+  '''
+    The source key saved with counts, or None if there are none.
+  '''
+  try:
+    with open(fname, 'rb') as fin:
+      return pickle.load(fin)
+  except (OSError, EOFError, pickle.UnpicklingError):
+    return None
+
+
+def load_counts(fname):
+  with open(fname, 'rb') as fin:
+    pickle.load(fin)
+    return pickle.load(fin)
+
+
+def lookup_arrays(ids, key_lists):
+  '''
+    Yield, for each list of keys in local ID order, the array whose entry i
+    is the final ID (from ids, an IDMap or ExternalIDMap) of local ID i.
+    Keys without an ID map to 0.
+  '''
+  for key_ids in ids.get_many_lists(key_lists, 0):
+    yield np.array([0] + key_ids, dtype=np.int64)
+
+
+def read_rows(fname, block=1 << 20):
+  '''
+    Yield the rows of a .ids file as (n x 4) arrays of at most block rows.
+  '''
+  with open(fname, 'rb') as fin:
+    while True:
+      rows = np.fromfile(fin, dtype=np.uint32, count=block * len(COLUMNS))
+      if len(rows) == 0:
+        break
+      yield rows.reshape(-1, len(COLUMNS))
+
+
+def remap_rows(fname, lookups):
+  '''
+    Yield ([uids, sids, wids, tids], pruned) for each block of a .ids file:
+    the final IDs of the rows whose keys all have one, and the number of
+    rows dropped.
+  '''
+  for rows in read_rows(fname):
+    cols = [lookup[rows[:, c]] for c, lookup in enumerate(lookups)]
+    keep = (cols[0] != 0) & (cols[1] != 0) & (cols[2] != 0) & (cols[3] != 0)
+    pruned = len(rows) - int(keep.sum())
+    if pruned:
+      cols = [col[keep] for col in cols]
+    yield cols, pruned
@@ -1,6 +1,8 @@
 
+import os
 import sys
-from nltk.stem.porter import PorterStemmer
+import functools
+import itertools
 import string
 
 stops = 'a,able,about,across,after,all,almost,also,am,among,an,and,any,are,as,at,be,because,been,but,by,can,cannot,could,dear,did,do,does,either,else,ever,every,for,from,get,got,had,has,have,he,her,hers,him,his,how,however,i,if,in,into,is,it,its,just,least,let,like,likely,may,me,might,most,must,my,neither,no,nor,not,of,off,often,on,only,or,other,our,own,rather,said,say,says,she,should,since,so,some,than,that,the,their,them,then,there,these,they,this,tis,to,too,twas,us,wants,was,we,were,what,when,where,which,while,who,whom,why,will,with,would,yet,you,your'
@@ -19,20 +21,212 @@ filter_table = str.maketrans(\
     string.ascii_lowercase + string.ascii_uppercase + ' ',\
     string.ascii_lowercase + string.ascii_lowercase + ' ',\
     deletions)
+# Lone surrogates, which truncated emoji escapes leave in JSON text, cannot
+# be encoded to UTF-8: drop them too, so that they never reach a key, a map,
+# or a stem table.
+filter_table.update(dict.fromkeys(range(0xD800, 0xE000)))
 
-# load porter stemmer
-stemmer = PorterStemmer()
+# Byte-level versions of filter_table, used on ASCII (or pre-encoded ASCII)
+# text. Translating bytes is a plain 256-entry table walk, and is
+# considerably faster than the per-character dict lookups of str.translate.
+ascii_table = bytes.maketrans(string.ascii_uppercase.encode(),
+    string.ascii_lowercase.encode())
+ascii_deletions = bytes(c for c in range(256) if chr(c) not in letter_set)
+
+# Porter stemmer, loaded by get_stemmer() the first time a word is stemmed.
+# Importing NLTK is by far the slowest part of importing this module, and
+# scripts that never tokenize should not pay for it.
+stemmer = None
+
+def get_stemmer():
+  global stemmer
+  if stemmer is None:
+    from nltk.stem.porter import PorterStemmer
+    stemmer = PorterStemmer()
+  return stemmer
 
 max_word_len = sys.getrecursionlimit()
 
+# Number of distinct words whose stems are kept in memory. Words follow a
+# heavy-tailed distribution, so a few hundred thousand entries catch nearly
+# every token. Least recently used words are evicted beyond this size.
+STEM_CACHE_SIZE = 1 << 19
+
+# Optional persistent stem table shared across dataset builds. Each line of
+# the file is "word stem". See load_stem_table(). The loaded stems are only
+# read: words stemmed since are collected in new_stems, which holds at most
+# STEM_BUFFER_SIZE of them before flush_stems() appends them to the file.
+STEM_BUFFER_SIZE = 1 << 16
+stem_table = {}
+stem_table_fname = None
+new_stems = {}
+
+@functools.lru_cache(maxsize=STEM_CACHE_SIZE)
+def stem(word):
+  s = stem_table.get(word)
+  if s is None:
+    s = get_stemmer().stem(word)
+    if stem_table_fname is not None:
+      new_stems[word] = s
+      if len(new_stems) >= STEM_BUFFER_SIZE:
+        flush_stems()
+  return s
+
+
+def load_stem_table(fname, compact=True):
+  '''
+    Load the stems saved by previous runs from fname, and append any newly
+    stemmed words to it. Stems recorded more than once (by concurrent or
+    overlapping runs) are compacted away unless compact is False. Returns the
+    number of stems loaded.
+  '''
+  global stem_table, stem_table_fname
+  close_stem_table()
+  stem_table = {}
+  nlines = 0
+  if os.path.exists(fname):
+    with open(fname, 'r') as fin:
+      for line in fin:
+        nlines += 1
+        entry = line.split()
+        # skip lines truncated by a crashed run
+        if len(entry) == 2:
+          stem_table[entry[0]] = entry[1]
+  if compact and nlines > len(stem_table):
+    with open(fname + '.part', 'w') as fout:
+      fout.writelines('{} {}\n'.format(w, s) for w, s in stem_table.items())
+    os.replace(fname + '.part', fname)
+  stem_table_fname = fname
+  stem.cache_clear()
+  return len(stem_table)
+
+
+def add_stems(stems):
+  '''
+    Record (word, stem) pairs stemmed elsewhere (e.g., by a worker process)
+    unless they are already known.
+  '''
+  for word, s in stems:
+    if word not in stem_table and word not in new_stems:
+      new_stems[word] = s
+  if len(new_stems) >= STEM_BUFFER_SIZE:
+    flush_stems()
+
+
+def take_new_stems():
+  '''
+    Return the (word, stem) pairs recorded since the last call, and forget
+    them.
+  '''
+  stems = list(new_stems.items())
+  new_stems.clear()
+  return stems
+
+
+def flush_stems():
+  '''
+    Append the newly stemmed words to the stem table file.
+  '''
+  stems = take_new_stems()
+  if stems and stem_table_fname is not None:
+    # one append per flush, so that concurrent writers never interleave
+    # within a line
+    with open(stem_table_fname, 'a') as fout:
+      fout.write(''.join('{} {}\n'.format(w, s) for w, s in stems))
+
+
+def close_stem_table():
+  global stem_table_fname
+  flush_stems()
+  stem_table_fname = None
+
+
+def stem_cache_info():
+  '''
+    Return the (hits, misses, maxsize, currsize) tuple of the stem cache.
+  '''
+  return stem.cache_info()
+
+
+def tokenize(text_string):
+  '''
+    Return the lowercase words of text_string, with everything but letters
+    and spaces removed. text_string may be a str or UTF-8 bytes; ASCII input
+    takes a byte-level fast path that produces the same tokens.
+  '''
+  if isinstance(text_string, bytes):
+    if not text_string.isascii():
+      return tokenize(text_string.decode('utf-8'))
+  elif text_string.isascii():
+    text_string = text_string.encode('ascii')
+  else:
+    return text_string.translate(filter_table).split()
+
+  return text_string.translate(ascii_table, ascii_deletions).decode('ascii').split()
+
+
 def parse_text(text_string):
-  for word in text_string.translate(filter_table).split():
+  for word in tokenize(text_string):
     # Sometimes the stemmer crashes due to maximum recursion depth.
     # Don't parse very long words.
     if (word not in stop_words) and (len(word) < max_word_len):
       try:
-        yield stemmer.stem(word)
-      except:
+        word = stem(word)
+      except Exception:
         print("ERROR '{}'".format(word))
-        break
+        continue
+      yield word
+
+
+def _init_worker(table_fname):
+  # Forked workers inherit the parent's stem table, and its new stems,
+  # which are the parent's to flush. Spawned workers start from a fresh
+  # import and must load the table themselves.
+  new_stems.clear()
+  if table_fname and stem_table_fname is None:
+    load_stem_table(table_fname, compact=False)
+
+
+def _parse_list(text_string):
+  return list(parse_text(text_string))
+
+
+def _parse_list_stems(text_string):
+  # Pool workers are terminated without a chance to flush, so they hand
+  # their new stems back to the parent with the tokens instead.
+  return _parse_list(text_string), take_new_stems()
+
+
+def parse_texts(texts, nworkers=1, chunksize=64):
+  '''
+    Parse an iterable of documents with parse_text(), spread across nworkers
+    processes. Yields one list of tokens per document, in input order. Only a
+    couple of batches are read ahead, so texts may be a lazy stream.
+  '''
+  texts = iter(texts)
+  if nworkers <= 1:
+    for text_string in texts:
+      yield _parse_list(text_string)
+    return
+
+  import multiprocessing
+
+  # Load NLTK once here so that forked workers inherit it instead of each
+  # importing it on their first word.
+  get_stemmer()
 
+  batch_size = nworkers * chunksize * 4
+  with multiprocessing.Pool(nworkers, _init_worker, (stem_table_fname,)) as pool:
+    batch = list(itertools.islice(texts, batch_size))
+    pending = pool.map_async(_parse_list_stems, batch, chunksize)
+    while pending is not None:
+      # queue up the next batch before handing back the current one
+      batch = list(itertools.islice(texts, batch_size))
+      following = None
+      if batch:
+        following = pool.map_async(_parse_list_stems, batch, chunksize)
+      for tokens, stems in pending.get():
+        if stems:
+          add_stems(stems)
+        yield tokens
+      pending = following
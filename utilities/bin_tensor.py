@@ -0,0 +1,246 @@
+
+##############################################################################
+# Binary COO tensor format.
+#
+# All fields are little-endian:
+#
+#   char[8]   magic "FROSTTB1"
+#   uint32    nmodes
+#   uint8     index width in bytes (4 or 8)
+#   char      value type: 'd' (float64) or 'q' (int64)
+#   uint8[2]  padding
+#   uint64    nnz
+#   uint64    dims[nmodes]
+#   uintW     inds[nmodes][nnz]   one column per mode, 1-indexed as in .tns
+#   uint8     padding to an 8-byte boundary
+#   value     vals[nnz]
+#
+# Every column sits at a fixed offset, so readers can mmap the file and use
+# the columns in place without copying.
+##############################################################################
+
+import os
+import sys
+import mmap
+import time
+import struct
+import tempfile
+from array import array
+
+from tensor_writer import TensorWriter
+
+
+MAGIC = b'FROSTTB1'
+HEADER = struct.Struct('<8sIBc2xQ')
+
+_index_codes = {4: 'I', 8: 'Q'}
+
+
+def is_binary(fname):
+  '''
+    True if fname starts with the binary tensor magic.
+  '''
+  with open(fname, 'rb') as fin:
+    return fin.read(len(MAGIC)) == MAGIC
+
+
+def _layout(nmodes, nnz, width):
+  '''
+    Return the byte offsets of each index column and of the values.
+  '''
+  start = HEADER.size + 8 * nmodes
+  cols = [start + m * nnz * width for m in range(nmodes)]
+  vals = start + nmodes * nnz * width
+  vals += -vals % 8
+  return cols, vals
+
+
+def _tofile(arr, fout):
+  if sys.byteorder != 'little':
+    arr = array(arr.typecode, arr)
+    arr.byteswap()
+  arr.tofile(fout)
+
+
+class BinaryTensorWriter(TensorWriter):
+  '''
+    Drop-in replacement for TensorWriter which writes the binary format.
+    Columns are staged in temporary files while nonzeros stream in; on
+    close() the header is written with the final nnz and dims, followed by
+    the columns, using 32-bit indices whenever they fit.
+  '''
+
+  def __init__(self, fname, nmodes, block=1 << 16, value_type='d'):
+    self.fname = fname
+    self.nmodes = nmodes
+    self.width = nmodes + 1
+    self.block = block
+    self.value_type = value_type
+    self.to_value = float if value_type == 'd' else int
+
+    self.tmpdir = tempfile.TemporaryDirectory(prefix='bin-',
+        dir=os.path.dirname(os.path.abspath(fname)))
+    self.cols = [open(os.path.join(self.tmpdir.name, 'col-{}'.format(m)), 'wb')
+        for m in range(nmodes + 1)]
+    self.dims = [0] * nmodes
+
+    self.inds = array('Q')
+    self.vals = array(value_type)
+    self.pos = 0
+    self.closed = False
+
+    self.nnz = 0
+    self.start = time.perf_counter()
+    self.elapsed = None
+
+  def write(self, *nnz):
+    self.inds.extend(nnz[:self.nmodes])
+    self.vals.append(self.to_value(nnz[self.nmodes]))
+    if len(self.vals) == self.block:
+      self.flush()
+
+  def write_columns(self, inds, vals):
+    self.flush()
+    for m in range(self.nmodes):
+      col = array('Q', inds[m])
+      if col:
+        self.dims[m] = max(self.dims[m], max(col))
+      _tofile(col, self.cols[m])
+    _tofile(array(self.value_type, map(self.to_value, vals)),
+        self.cols[self.nmodes])
+    self.nnz += len(vals)
+
+  def count(self):
+    return self.nnz + len(self.vals)
+
+  def flush(self):
+    if not self.vals:
+      return
+    for m in range(self.nmodes):
+      col = self.inds[m::self.nmodes]
+      self.dims[m] = max(self.dims[m], max(col))
+      _tofile(col, self.cols[m])
+    _tofile(self.vals, self.cols[self.nmodes])
+    self.nnz += len(self.vals)
+    self.inds = array('Q')
+    self.vals = array(self.value_type)
+
+  def close(self):
+    if self.closed:
+      return
+    self.flush()
+    for col in self.cols:
+      col.close()
+
+    index_width = 4 if max(self.dims, default=0) < (1 << 32) else 8
+    col_offsets, val_offset = _layout(self.nmodes, self.nnz, index_width)
+
+    with open(self.fname, 'wb') as fout:
+      fout.write(HEADER.pack(MAGIC, self.nmodes, index_width,
+          self.value_type.encode(), self.nnz))
+      _tofile(array('Q', self.dims), fout)
+
+      for m in range(self.nmodes + 1):
+        if m == self.nmodes:
+          fout.write(b'\0' * (val_offset - fout.tell()))
+        self._copy_column(self.cols[m].name, fout,
+            'Q' if m < self.nmodes else self.value_type,
+            _index_codes[index_width] if m < self.nmodes else self.value_type)
+
+    self.tmpdir.cleanup()
+    self.closed = True
+    self.elapsed = time.perf_counter() - self.start
+
+  def _copy_column(self, fname, fout, src_code, dst_code, block=1 << 20):
+    with open(fname, 'rb') as fin:
+      while True:
+        buf = array(src_code)
+        try:
+          buf.fromfile(fin, block)
+        except EOFError:
+          pass
+        if not buf:
+          break
+        if sys.byteorder != 'little':
+          buf.byteswap()
+        if dst_code != src_code:
+          buf = array(dst_code, buf)
+        _tofile(buf, fout)
+
+
+class BinaryTensor:
+  '''
+    Memory-mapped binary tensor. Index columns and values are exposed as
+    zero-copy memoryviews by inds(m) and vals(), or as NumPy arrays by
+    arrays() when NumPy is installed. Iterating yields (inds, val) rows.
+  '''
+
+  def __init__(self, fname):
+    if sys.byteorder != 'little':
+      raise ValueError('binary tensors can only be mapped on little-endian hosts')
+
+    self.fname = fname
+    self._file = open(fname, 'rb')
+    self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, self.nmodes, self.index_width, value_type, self.nnz = \
+        HEADER.unpack_from(self._map, 0)
+    if magic != MAGIC:
+      raise ValueError('{} is not a binary tensor'.format(fname))
+    self.value_type = value_type.decode()
+    self.dims = list(struct.unpack_from('<{}Q'.format(self.nmodes), self._map,
+        HEADER.size))
+    self._cols, self._vals = _layout(self.nmodes, self.nnz, self.index_width)
+
+  def inds(self, m):
+    '''
+      The indices of mode m (0-based), as a memoryview into the file.
+    '''
+    start = self._cols[m]
+    view = memoryview(self._map)[start:start + self.nnz * self.index_width]
+    return view.cast(_index_codes[self.index_width])
+
+  def vals(self):
+    view = memoryview(self._map)[self._vals:self._vals + self.nnz * 8]
+    return view.cast(self.value_type)
+
+  def arrays(self):
+    '''
+      Return ([index arrays], value array) as NumPy views of the file.
+    '''
+    import numpy as np
+    itype = np.dtype('<u{}'.format(self.index_width))
+    inds = [np.frombuffer(self._map, itype, self.nnz, self._cols[m])
+        for m in range(self.nmodes)]
+    vals = np.frombuffer(self._map, np.dtype('<' + self.value_type), self.nnz,
+        self._vals)
+    return inds, vals
+
+  def __len__(self):
+    return self.nnz
+
+  def __iter__(self):
+    '''
+      Yield ([i, j, ...], val) for each nonzero, decoding a block at a time.
+    '''
+    cols = [self.inds(m) for m in range(self.nmodes)]
+    vals = self.vals()
+    block = 1 << 16
+    for start in range(0, self.nnz, block):
+      end = min(start + block, self.nnz)
+      chunk = [col[start:end].tolist() for col in cols]
+      for row, val in zip(zip(*chunk), vals[start:end].tolist()):
+        yield list(row), val
+    for col in cols:
+      col.release()
+    vals.release()
+
+  def close(self):
+    self._map.close()
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
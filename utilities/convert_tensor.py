@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+
+from bin_tensor import BinaryTensorWriter
+from tensor_writer import TensorWriter
+from tns_reader import TnsReader
+
+
+my_description = '''
+Convert a tensor between the .tns text format and the binary COO format
+described in bin_tensor.py. The direction is detected from the input file.
+Comments and blank lines in .tns input are skipped, and .tns input is parsed
+by worker processes (see tns_reader.py).
+'''
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=my_description,
+      formatter_class=argparse.RawTextHelpFormatter)
+
+  parser.add_argument('input', type=str, help='input tensor (.tns or binary)')
+  parser.add_argument('output', type=str, help='output tensor')
+  parser.add_argument('--value-type', choices=['d', 'q'], default='d',
+      help='binary value type: d (float64, default) or q (int64)')
+  parser.add_argument('--workers', type=int, default=None,
+      help='processes for parsing .tns input (default: all cores)')
+
+  args = parser.parse_args()
+
+  with TnsReader(args.input, workers=args.workers,
+      values=args.value_type) as reader:
+    if reader.nmodes == 0:
+      print('{}: no nonzeros found'.format(args.input))
+      sys.exit(1)
+
+    if reader.binary:
+      fout = TensorWriter(args.output, reader.nmodes)
+    else:
+      fout = BinaryTensorWriter(args.output, reader.nmodes,
+          value_type=args.value_type)
+    with fout:
+      for inds, vals in reader.chunks():
+        fout.write_columns([inds[:, m].tolist() for m in range(reader.nmodes)],
+            vals.tolist())
+  print(fout.report())
@@ -0,0 +1,165 @@
+
+##############################################################################
+# Map files hold one key per line, with the key of ID i on line i. Next to
+# each map file we keep a binary offsets sidecar "<map>.idx": an array of
+# len(keys) + 1 little-endian uint64 byte offsets, where key i spans bytes
+# [offsets[i-1], offsets[i]) of the map file (newline included). Tools can
+# mmap both and fetch any key without reading the whole map.
+#
+# Compressed map files (see parallel_compress.py) cannot be mapped, so they
+# are written without a sidecar.
+##############################################################################
+
+import os
+import sys
+import mmap
+from array import array
+
+from parallel_compress import compressed_name, is_compressed, open_output
+
+
+def index_fname(fname):
+  return fname + '.idx'
+
+
+def _write_offsets(fout, offsets):
+  if sys.byteorder != 'little':
+    offsets.byteswap()
+  offsets.tofile(fout)
+
+
+def write_map(fname, keys, block=65536):
+  '''
+    Stream keys (in ID order) to a map file and its offsets sidecar. Returns
+    the number of keys written.
+  '''
+  fname = compressed_name(fname)
+  if is_compressed(fname):
+    nkeys = 0
+    with open_output(fname, 'w') as fout:
+      for key in keys:
+        fout.write('{}\n'.format(key))
+        nkeys += 1
+    return nkeys
+
+  nkeys = 0
+  pos = 0
+  with open(fname, 'wb') as fout, open(index_fname(fname), 'wb') as fidx:
+    _write_offsets(fidx, array('Q', [0]))
+    lines = []
+    for key in keys:
+      lines.append('{}\n'.format(key).encode('utf-8'))
+      if len(lines) == block:
+        pos = _flush_lines(fout, fidx, lines, pos)
+        nkeys += len(lines)
+        lines = []
+    pos = _flush_lines(fout, fidx, lines, pos)
+    nkeys += len(lines)
+  return nkeys
+
+
+def _flush_lines(fout, fidx, lines, pos):
+  offsets = array('Q')
+  for line in lines:
+    pos += len(line)
+    offsets.append(pos)
+  fout.write(b''.join(lines))
+  _write_offsets(fidx, offsets)
+  return pos
+
+
+def build_index(fname, block=1 << 20):
+  '''
+    Write the offsets sidecar of an existing map file in one streaming pass.
+  '''
+  pos = 0
+  with open(fname, 'rb') as fin, open(index_fname(fname), 'wb') as fidx:
+    _write_offsets(fidx, array('Q', [0]))
+    tail = b''
+    while True:
+      buf = fin.read(block)
+      if not buf:
+        break
+      offsets = array('Q')
+      start = 0
+      nl = buf.find(b'\n')
+      while nl != -1:
+        offsets.append(pos + nl + 1)
+        start = nl + 1
+        nl = buf.find(b'\n', start)
+      tail = buf[start:]
+      pos += len(buf)
+      _write_offsets(fidx, offsets)
+    # last line without a trailing newline
+    if tail:
+      _write_offsets(fidx, array('Q', [pos]))
+
+
+class MapIndex:
+  '''
+    Random and range access to the keys of a map file through its offsets
+    sidecar, which is built first if missing or older than the map.
+  '''
+
+  def __init__(self, fname):
+    idx = index_fname(fname)
+    if not os.path.exists(idx) or \
+        os.path.getmtime(idx) < os.path.getmtime(fname):
+      build_index(fname)
+
+    self._fmap = open(fname, 'rb')
+    self._fidx = open(idx, 'rb')
+    self._map = self._mmap(self._fmap)
+    self._idx = self._mmap(self._fidx)
+    if sys.byteorder == 'little':
+      self.offsets = memoryview(self._idx).cast('Q')
+    else:
+      self.offsets = array('Q', self._idx)
+      self.offsets.byteswap()
+
+  @staticmethod
+  def _mmap(f):
+    if os.fstat(f.fileno()).st_size == 0:
+      return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def key(self, key_id):
+    '''
+      Return the key with (1-based) ID key_id.
+    '''
+    if key_id < 1 or key_id > len(self):
+      raise IndexError('key {} out of range (1..{})'.format(key_id, len(self)))
+    start = self.offsets[key_id - 1]
+    end = self.offsets[key_id]
+    return self._map[start:end].decode('utf-8').rstrip('\n')
+
+  def keys(self, first=1, last=None, block=65536):
+    '''
+      Yield the keys with IDs first..last (inclusive), in ID order, decoding
+      block keys at a time.
+    '''
+    if last is None:
+      last = len(self)
+    for lo in range(first, last + 1, block):
+      hi = min(lo + block - 1, last)
+      chunk = self._map[self.offsets[lo - 1]:self.offsets[hi]].decode('utf-8')
+      for line in chunk.split('\n')[:hi - lo + 1]:
+        yield line
+
+  def close(self):
+    if isinstance(self.offsets, memoryview):
+      self.offsets.release()
+    for m in (self._map, self._idx):
+      if isinstance(m, mmap.mmap):
+        m.close()
+    self._fmap.close()
+    self._fidx.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
@@ -1,38 +1,104 @@
 #!/usr/bin/env python3
 
 ##############################################################################
-# This script takes a gap file produced by prune_infreq.py or SPLATT and a map
-# file of keys, and merges them into a new map file with gapped keys removed.
+# This script takes the gap files produced by prune_infreq.py or SPLATT and a
+# map file of keys, and merges them into a new map file with gapped keys
+# removed.
+#
+# Several gap files may be given, in the order the pruning rounds produced
+# them. They are composed into one array of original key IDs first, and the
+# key map is then read once: through its offsets sidecar (see map_file.py)
+# if it has one, otherwise in a single streaming pass.
 ##############################################################################
 
+import os
 import sys
 
-if len(sys.argv) != 4:
-  print('usage: {} <mode-X-gaps.map> <mode-X-keys.map> <new.map>'.format(sys.argv[0]))
-  sys.exit(1)
+import numpy as np
 
+from map_file import MapIndex, index_fname, write_map
 
-gap_fname = sys.argv[1]
-key_fname = sys.argv[2]
-new_fname = sys.argv[3]
 
-# read keys
-keys = []
-with open(key_fname, 'r') as fin:
-  for line in fin:
-    keys.append(line.strip())
+def read_gap_map(fname, block=1 << 24):
+  '''
+    Read a gap map into an array: entry j is the old ID of new ID j + 1.
+  '''
+  parts = []
+  with open(fname, 'rb') as fin:
+    while True:
+      buf = fin.read(block)
+      if not buf:
+        break
+      buf += fin.readline()
+      parts.append(np.array(buf.split()).astype(np.int64))
+  if not parts:
+    return np.empty(0, dtype=np.int64)
+  return np.concatenate(parts)
 
 
-fout = open(new_fname, 'w')
-with open(gap_fname, 'r') as gap_file:
-  for line in gap_file:
-    # new ID
-    key_id = int(line.strip())
-    try:
-      key = keys[key_id - 1]
-    except:
-      print('keys: {} found key {}'.format(len(keys), key_id))
+def compose_gap_maps(fnames):
+  '''
+    Compose gap maps, first round first, into one array of the original IDs
+    of the final keys.
+  '''
+  ids = read_gap_map(fnames[-1])
+  for fname in reversed(fnames[:-1]):
+    prev = read_gap_map(fname)
+    if len(ids) and (ids.min() < 1 or ids.max() > len(prev)):
+      raise ValueError('{}: has {} IDs, found ID {}'.format(fname, len(prev),
+          ids.max()))
+    ids = prev[ids - 1]
+  return ids
 
-    print(key, file=fout)
-fout.close()
 
+def streamed_keys(key_fname, ids):
+  '''
+    Yield the keys with the given increasing IDs in one pass over the map.
+  '''
+  ids = iter(ids.tolist())
+  want = next(ids, None)
+  key_id = 0
+  with open(key_fname, 'r') as fin:
+    for key_id, line in enumerate(fin, 1):
+      if key_id == want:
+        yield line.strip()
+        want = next(ids, None)
+        if want is None:
+          return
+  if want is not None:
+    raise IndexError('keys: {} found key {}'.format(key_id, want))
+
+
+def indexed_keys(key_fname, ids):
+  with MapIndex(key_fname) as index:
+    for key_id in ids.tolist():
+      yield index.key(key_id).strip()
+
+
+if __name__ == '__main__':
+  if len(sys.argv) < 4:
+    print('usage: {} <mode-X-gaps.map>... <mode-X-keys.map> <new.map>'.format(
+        sys.argv[0]))
+    print('gap maps are listed in the order they were produced')
+    sys.exit(1)
+
+  gap_fnames = sys.argv[1:-2]
+  key_fname = sys.argv[-2]
+  new_fname = sys.argv[-1]
+
+  ids = compose_gap_maps(gap_fnames)
+
+  # An increasing ID list (as prune_infreq.py writes) can be streamed;
+  # anything else needs random access through the sidecar.
+  increasing = len(ids) < 2 or bool(np.all(ids[1:] > ids[:-1]))
+  if os.path.exists(index_fname(key_fname)) or not increasing:
+    keys = indexed_keys(key_fname, ids)
+  else:
+    keys = streamed_keys(key_fname, ids)
+
+  try:
+    nkeys = write_map(new_fname, keys)
+  except IndexError as err:
+    print(err)
+    sys.exit(1)
+  print('{}: {:,d} keys'.format(new_fname, nkeys))
@@ -0,0 +1,120 @@
+
+##############################################################################
+# Block-parallel compressed output, in the style of pbzip2/pigz.
+#
+# Written data is cut into large blocks which are compressed concurrently by
+# a thread pool (bz2, zlib, and lzma all release the GIL while compressing).
+# Each block becomes a complete bz2/gzip/xz stream, and the streams are
+# written in order. Concatenated streams are valid files for all three
+# formats, so the output decompresses with the standard tools or with
+# bz2.open()/gzip.open()/lzma.open().
+##############################################################################
+
+import os
+import bz2
+import gzip
+import lzma
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+CODECS = {
+  '.bz2': lambda block, level: bz2.compress(block, level or 9),
+  '.gz':  lambda block, level: gzip.compress(block, level or 6, mtime=0),
+  '.xz':  lambda block, level: lzma.compress(block, preset=level),
+}
+
+
+def is_compressed(fname):
+  return os.path.splitext(fname)[1] in CODECS
+
+
+def compressed_name(fname):
+  '''
+    Add the extension from the TNS_COMPRESS environment variable (bz2, gz,
+    or xz) to fname, if it is set and fname is not already compressed.
+  '''
+  ext = os.environ.get('TNS_COMPRESS')
+  if ext and not is_compressed(fname):
+    fname = '{}.{}'.format(fname, ext.lstrip('.'))
+  return fname
+
+
+def open_output(fname, mode='w', **kwargs):
+  '''
+    open() for writing, compressing in parallel if fname ends in a
+    compressed extension.
+  '''
+  if is_compressed(fname):
+    return ParallelCompressedFile(fname, mode, **kwargs)
+  return open(fname, mode)
+
+
+class ParallelCompressedFile:
+  '''
+    Write-only file object which compresses block_size chunks of output on
+    a pool of worker threads. At most 2 * workers blocks are in flight.
+    flush() does not cut a block short; everything reaches the disk on
+    close().
+  '''
+
+  def __init__(self, fname, mode='w', workers=None, block_size=1 << 22,
+      level=None):
+    ext = os.path.splitext(fname)[1]
+    if ext not in CODECS:
+      raise ValueError('unknown compression for {}'.format(fname))
+    if 'r' in mode or 'a' in mode:
+      raise ValueError('ParallelCompressedFile is write-only')
+
+    self.name = fname
+    self.text = 'b' not in mode
+    self.codec = CODECS[ext]
+    self.level = level
+    self.block_size = block_size
+
+    workers = workers or os.cpu_count() or 1
+    self.pool = ThreadPoolExecutor(workers)
+    self.max_pending = 2 * workers
+    self.pending = collections.deque()
+
+    self.raw = open(fname, 'wb')
+    self.buf = []
+    self.buflen = 0
+    self.closed = False
+
+  def write(self, data):
+    if self.text:
+      data = data.encode('utf-8')
+    self.buf.append(data)
+    self.buflen += len(data)
+    if self.buflen >= self.block_size:
+      self._submit()
+    return len(data)
+
+  def _submit(self):
+    block = b''.join(self.buf)
+    self.buf = []
+    self.buflen = 0
+    self.pending.append(self.pool.submit(self.codec, block, self.level))
+    while len(self.pending) > self.max_pending:
+      self.raw.write(self.pending.popleft().result())
+
+  def flush(self):
+    pass
+
+  def close(self):
+    if self.closed:
+      return
+    if self.buf:
+      self._submit()
+    while self.pending:
+      self.raw.write(self.pending.popleft().result())
+    self.raw.close()
+    self.pool.shutdown()
+    self.closed = True
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 
 import argparse
-from collections import Counter
+
+import numpy as np
+
+from tensor_writer import open_tensor
+from tns_reader import TnsReader
 
 
 my_description = '''
@@ -12,6 +17,9 @@ script scans a tensor file and removes empty slices. Those slices are then
 specified with "mode-X-gaps.map" files which map the old dimensionality into
 the new one.
 
+The input may be a .tns file or a binary tensor (see convert_tensor.py). The
+output is written in binary if its name ends in ".bin".
+
 Infrequent items can also be pruned by specifying "--mode=MODE,FREQ"
 options. For example, "--mode=3,5" will remove any slices in the third mode
 with less than five non-zeros.
@@ -19,114 +27,205 @@ with less than five non-zeros.
 NOTE: since this process removes non-zeros, it can cause slices in other modes
 to become infrequent or empty. If any non-zeros are pruned, this script should
 be re-run until no additional empty/infrequent slices are present.  Map files
-should be merged with `merge_gap_keys.py` after each run, as they will be
-overwritten if a mode is pruned additional times.
-'''
-
-parser = argparse.ArgumentParser(description=my_description,
-    formatter_class=argparse.RawTextHelpFormatter)
-
-parser.add_argument('tensor', type=str, help='tensor to prune')
-parser.add_argument('output', type=str, help='output tensor')
-parser.add_argument('--mode', metavar='MODE,MIN-FREQ', action='append',
-    help='min. frequency for a mode (default: 1)')
+should be renamed after each run, as they will be overwritten if a mode is
+pruned additional times; `merge_gap_keys.py` then composes all of them with
+the key map at once.
 
-args = parser.parse_args()
+Alternatively, "--until-stable" loads the tensor into memory once and prunes
+it repeatedly until no slice falls under its minimum frequency. The final
+tensor is written once, and each "mode-X-gaps.map" maps the final IDs
+directly to the IDs of the input tensor.
 
-# First get the number of modes
-nmodes = 0
-with open(args.tensor, 'r') as fin:
-  line = fin.readline()
-  nmodes = len(line.split()[:-1]) # skip the val at the end
-
-
-# Get user-specified minimum frequencies
-mode_mins = [1] * nmodes
-if args.mode:
-  for mode_tup in args.mode:
-    mode_tup = mode_tup.split(',')
-    m = int(mode_tup[0]) - 1
-    freq = int(mode_tup[1])
-    mode_mins[m] = freq
+.tns input is parsed in chunks by worker processes (see tns_reader.py), and
+slices are counted and remapped with NumPy arrays.
+'''
 
-print('minimum frequencies: {}'.format(mode_mins))
 
-def read_tensor(fname):
+def count_slices(inds, vals):
   '''
-    Read each line of the tensor and return a list of indices and the value.
-    This function skips comments and blank lines.
+    Count the non-zeros in each slice of each mode of a chunk.
   '''
-  with open(fname, 'r') as fin:
-    for line in fin:
-      # skip comments and blank lines
-      if line[0] == '#' or line is '':
-        continue
-
-      # convert to integers and return list
-      line = line.strip().split()
-      yield [int(x) for x in line[:-1]], line[-1]
-    
-
+  return [np.bincount(inds[:, m]) for m in range(inds.shape[1])]
 
-# Count appearances in each mode.
-ind_counts = [Counter() for x in range(nmodes)]
-for inds, val in read_tensor(args.tensor):
-  for m in range(nmodes):
-    ind_counts[m][inds[m]] += 1
 
+def add_counts(total, counts):
+  if len(counts) > len(total):
+    counts = counts.copy()
+    counts[:len(total)] += total
+    return counts
+  total[:len(counts)] += counts
+  return total
 
-# indmaps[m][i] gives the NEW index for original slice i
-ind_maps = [dict() for m in range(nmodes)]
 
-# Go over counts and prune infrequent slices
-gapped_modes = []
-for m in range(nmodes):
-  for index in ind_counts[m].keys():
-    if ind_counts[m][index] < mode_mins[m]:
-      ind_counts[m][index] = 0
+def write_gap_map(m, keep):
+  '''
+    Write the original indices of the kept slices of mode m (0-based).
+  '''
+  with open('mode-{}-gaps.map'.format(m+1), 'w') as mapfile:
+    for i in keep.tolist():
+      print('{}'.format(i), file=mapfile)
 
-  # prune
-  keep = [x for x in sorted(ind_counts[m]) if ind_counts[m][x] >= mode_mins[m]]
 
-  gaplen = max(ind_counts[m]) - len(keep)
-  # Have we pruned any slices?
-  if gaplen > 0:
-    gapped_modes.append(m)
-    print('mode-{}: {} empty slices'.format(m+1, gaplen))
+def new_id_map(keep, dim):
+  '''
+    Dense lookup array: new_ids[i] is the NEW index of original slice i, or 0
+    if slice i is pruned.
+  '''
+  new_ids = np.zeros(dim + 1, dtype=np.int64)
+  new_ids[keep] = np.arange(1, len(keep) + 1)
+  return new_ids
 
-    # assign new IDs and write map file
-    with open('mode-{}-gaps.map'.format(m+1), 'w') as mapfile:
-      for i in keep:
-        ind_maps[m][i] = len(ind_maps[m]) + 1
-        # invert map and write to file
-        print('{}'.format(i), file=mapfile)
 
+def write_chunk(fout, inds, vals, remap):
+  '''
+    Remap the indices of a chunk, dropping non-zeros in pruned slices, and
+    write the rest. remap is a list of (mode, new_ids). Returns the number of
+    non-zeros written.
+  '''
+  mask = np.ones(len(inds), dtype=bool)
+  cols = [inds[:, m] for m in range(inds.shape[1])]
+  for m, new_ids in remap:
+    cols[m] = new_ids[cols[m]]
+    mask &= (cols[m] != 0)
+  if not mask.all():
+    cols = [col[mask] for col in cols]
+    vals = vals[mask]
+  fout.write_columns([col.tolist() for col in cols], vals.tolist())
+  return len(vals)
+
+
+def prune_until_stable(reader, mode_mins, output):
+  '''
+    Repeat count -> prune in memory until no non-zeros are removed, with
+    mode_mins[m] the minimum frequency of mode m, and write the result to
+    output. Slices keep their original indices between rounds, so the
+    composition of every round's gap map is just the final set of surviving
+    slices, which are reindexed once while writing.
+  '''
+  nmodes = reader.nmodes
+  inds, vals = reader.read_all()
+  nnz = len(vals)
+  dims = [int(inds[:, m].max()) if nnz else 0 for m in range(nmodes)]
+  alive = np.ones(nnz, dtype=bool)
+
+  rounds = 0
+  while True:
+    rounds += 1
+    # keep[m][i] is True if slice i of mode m is frequent enough
+    keep = []
+    for m in range(nmodes):
+      counts = np.bincount(inds[alive, m], minlength=dims[m] + 1)
+      keep.append(counts >= max(mode_mins[m], 1))
+
+    before = int(alive.sum())
+    for m in range(nmodes):
+      alive &= keep[m][inds[:, m]]
+    pruned = before - int(alive.sum())
+    print('round {}: pruned nnz: {:,d}'.format(rounds, pruned))
+    if pruned == 0:
+      break
+
+  # only gapped modes are remapped
+  remap = []
+  for m in range(nmodes):
+    keep_inds = np.flatnonzero(keep[m][1:]) + 1
+    gaplen = dims[m] - len(keep_inds)
+    if gaplen > 0:
+      print('mode-{}: {} empty slices'.format(m+1, gaplen))
+      remap.append((m, new_id_map(keep_inds, dims[m])))
+      write_gap_map(m, keep_inds)
+
+  if len(remap) == 0:
+    print('no empty slices')
+    return
+
+  inds = inds[alive]
+  vals = vals[alive]
+  step = 1 << 20
+  with open_tensor(output, nmodes, value_type=reader.value_type) as fout:
+    for start in range(0, len(vals), step):
+      write_chunk(fout, inds[start:start+step], vals[start:start+step], remap)
+
+  print('rounds: {} pruned nnz: {:,d} new nnz: {:,d}'.format(rounds,
+      nnz - len(vals), len(vals)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=my_description,
+      formatter_class=argparse.RawTextHelpFormatter)
+
+  parser.add_argument('tensor', type=str, help='tensor to prune')
+  parser.add_argument('output', type=str, help='output tensor')
+  parser.add_argument('--mode', metavar='MODE,MIN-FREQ', action='append',
+      help='min. frequency for a mode (default: 1)')
+  parser.add_argument('--until-stable', action='store_true',
+      help='prune in memory until no more slices are removed')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(),
+      help='processes for parsing .tns input (default: all cores)')
+
+  args = parser.parse_args()
+
+  # First get the number of modes
+  reader = TnsReader(args.tensor, workers=max(args.workers, 1))
+  nmodes = reader.nmodes
+  value_type = reader.value_type
+
+
+  # Get user-specified minimum frequencies
+  mode_mins = [1] * nmodes
+  if args.mode:
+    for mode_tup in args.mode:
+      mode_tup = mode_tup.split(',')
+      m = int(mode_tup[0]) - 1
+      freq = int(mode_tup[1])
+      mode_mins[m] = freq
+
+  print('minimum frequencies: {}'.format(mode_mins))
+
+  if args.until_stable:
+    with reader:
+      prune_until_stable(reader, mode_mins, args.output)
+    sys.exit(0)
+
+
+  # Count appearances in each mode.
+  ind_counts = [np.zeros(1, dtype=np.int64) for m in range(nmodes)]
+  for counts in reader.map(count_slices):
+    for m in range(nmodes):
+      ind_counts[m] = add_counts(ind_counts[m], counts[m])
+
+
+  # remap[m] gives the NEW index for each original slice of a gapped mode
+  remap = []
+  for m in range(nmodes):
+    # prune
+    keep = np.flatnonzero(ind_counts[m] >= max(mode_mins[m], 1))
+    dim = len(ind_counts[m]) - 1
 
+    gaplen = dim - len(keep)
+    # Have we pruned any slices?
+    if gaplen > 0:
+      print('mode-{}: {} empty slices'.format(m+1, gaplen))
 
-if len(gapped_modes) == 0:
-  print('no empty slices')
-  sys.exit(0)
+      # assign new IDs and write map file
+      remap.append((m, new_id_map(keep, dim)))
+      write_gap_map(m, keep)
 
 
-# Go back over the tensor and map indices
-nnz = 0
-pruned_nnz = 0
-with open(args.output, 'w') as fout:
-  for inds, val in read_tensor(args.tensor):
-    pruned = False
 
-    # map indices and check for pruned nnz
-    for m in gapped_modes:
-      if inds[m] in ind_maps[m]:
-        inds[m] = ind_maps[m][inds[m]]
-      else:
-        pruned = True
-        pruned_nnz += 1
+  if len(remap) == 0:
+    print('no empty slices')
+    reader.close()
+    sys.exit(0)
 
-    # write non-zero
-    if not pruned:
-      print('{} {}'.format(' '.join(map(str, inds)), val), file=fout)
-      nnz += 1
 
-print('pruned nnz: {:,d} new nnz: {:,d}'.format(pruned_nnz, nnz))
+  # Go back over the tensor and map indices
+  nnz = 0
+  total_nnz = 0
+  with open_tensor(args.output, nmodes, value_type=value_type) as fout:
+    for inds, vals in reader.chunks():
+      nnz += write_chunk(fout, inds, vals, remap)
+      total_nnz += len(vals)
 
+  reader.close()
+  print('pruned nnz: {:,d} new nnz: {:,d}'.format(total_nnz - nnz, nnz))
@@ -0,0 +1,272 @@
+
+##############################################################################
+# Read-ahead of (compressed) line-oriented input on a background thread.
+#
+# ReadAhead reads and decompresses a file on its own thread and passes
+# batches of lines to the consumer through a bounded queue, so that
+# decompressing the next batch overlaps with parsing the current one. bz2,
+# zlib, and lzma release the GIL while they decompress.
+#
+#   with ReadAhead('RC_2015-01.bz2') as lines:
+#     for line in lines:
+#       ...
+#   print(lines.report())
+#
+# The reader counts the time each side spends waiting on the other. If the
+# reader mostly waits on a full queue, parsing is the bottleneck; if the
+# consumer mostly waits on an empty one, decompression is.
+#
+# bzip2 is slow enough to be the bottleneck by itself, so with workers > 1 a
+# .bz2 file is also decompressed in parallel, like lbzip2 does it: the
+# compressed blocks of a stream are found by their bit-aligned 48-bit
+# markers, and each is wrapped into a stream of its own and decompressed on
+# a thread pool.
+##############################################################################
+
+import os
+import bz2
+import gzip
+import lzma
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+OPENERS = {
+  '.bz2': bz2.open,
+  '.gz':  gzip.open,
+  '.xz':  lzma.open,
+}
+
+
+# bzip2 stream layout: "BZh" and a level digit, then blocks which each start
+# with BLOCK_MAGIC and their CRC, then STREAM_END and the combined CRC, padded
+# to a byte. Markers are not byte-aligned.
+BLOCK_MAGIC = 0x314159265359
+STREAM_END = 0x177245385090
+STREAM_HEADER = int.from_bytes(b'BZh9', 'big')
+
+
+def _magic_patterns(magic):
+  '''
+    (shift, pattern) for each bit offset into a byte at which magic may
+    start: pattern is the bytes that the 48-bit magic then covers whole.
+  '''
+  patterns = []
+  for shift in range(8):
+    window = (magic << (8 - shift)).to_bytes(7, 'big')
+    patterns.append((shift, window[:6] if shift == 0 else window[1:6]))
+  return patterns
+
+MARKERS = [(magic, _magic_patterns(magic)) for magic in (BLOCK_MAGIC, STREAM_END)]
+
+
+def _bits(buf, start, nbits):
+  '''
+    The nbits bits of buf starting at bit start, as an int.
+  '''
+  first = start // 8
+  last = (start + nbits + 7) // 8
+  value = int.from_bytes(buf[first:last], 'big')
+  return (value >> (last * 8 - start - nbits)) & ((1 << nbits) - 1)
+
+
+def _find_markers(buf):
+  '''
+    Sorted (bit offset, magic) of the block and stream-end markers in buf
+    which are followed by their 32-bit CRC.
+  '''
+  markers = []
+  nbits = len(buf) * 8
+  for magic, patterns in MARKERS:
+    for shift, pattern in patterns:
+      skip = 0 if shift == 0 else 1
+      pos = buf.find(pattern, skip)
+      while pos >= 0:
+        start = (pos - skip) * 8 + shift
+        if start + 80 <= nbits and _bits(buf, start, 48) == magic:
+          markers.append((start, magic))
+        pos = buf.find(pattern, pos + 1)
+  markers.sort()
+  return markers
+
+
+def _block_stream(buf, start, end):
+  '''
+    Wrap the block at bits [start, end) of buf into a complete bz2 stream.
+    The combined CRC of a one-block stream is the block's CRC.
+  '''
+  crc = _bits(buf, start + 48, 32)
+  nbits = end - start
+  stream = (STREAM_HEADER << nbits) | _bits(buf, start, nbits)
+  stream = (((stream << 48) | STREAM_END) << 32) | crc
+  nbits += 32 + 48 + 32
+  pad = -nbits % 8
+  return (stream << pad).to_bytes((nbits + pad) // 8, 'big')
+
+
+def bz2_blocks(fin, chunk_bytes=1 << 22):
+  '''
+    Yield each compressed block of a (multi-stream) bz2 file as a stream of
+    its own, which bz2.decompress() accepts. Only the blocks not yet
+    complete are held in memory.
+  '''
+  buf = b''
+  while True:
+    data = fin.read(chunk_bytes)
+    buf += data
+    markers = _find_markers(buf)
+    # a block ends where the next block (or the stream) does
+    for (start, magic), (end, _) in zip(markers, markers[1:]):
+      if magic == BLOCK_MAGIC:
+        yield _block_stream(buf, start, end)
+    if not data:
+      if markers and markers[-1][1] == BLOCK_MAGIC:
+        raise EOFError('Compressed file ended before the end-of-stream '
+            'marker was reached')
+      return
+    # keep the last (incomplete) block
+    if markers:
+      buf = buf[markers[-1][0] // 8:]
+
+
+def open_input(fname, mode='rt'):
+  '''
+    open() for reading, decompressing if fname ends in a compressed
+    extension.
+  '''
+  opener = OPENERS.get(os.path.splitext(fname)[1], open)
+  return opener(fname, mode)
+
+
+class ReadAhead:
+  '''
+    Iterates over the lines of fname, which a background thread reads in
+    batches of about batch_bytes. At most depth batches wait in the queue.
+    With workers > 1, .bz2 blocks are decompressed on that many threads, and
+    a batch holds the lines of a block.
+  '''
+
+  def __init__(self, fname, mode='rt', batch_bytes=1 << 20, depth=8,
+      workers=1):
+    self.fname = fname
+    self.mode = mode
+    self.batch_bytes = batch_bytes
+    self.depth = depth
+    self.workers = workers
+
+    self.queue = queue.Queue(depth)
+    self.stopped = threading.Event()
+
+    # counters
+    self.batches = 0
+    self.gets = 0
+    self.queued = 0
+    self.reader_wait = 0.0
+    self.consumer_wait = 0.0
+
+    read = self._read
+    if workers > 1 and fname.endswith('.bz2'):
+      read = self._read_blocks
+    self.thread = threading.Thread(target=read, daemon=True)
+    self.thread.start()
+
+  def _put(self, item):
+    start = time.perf_counter()
+    while not self.stopped.is_set():
+      try:
+        self.queue.put(item, timeout=0.1)
+        break
+      except queue.Full:
+        pass
+    self.reader_wait += time.perf_counter() - start
+
+  def _read(self):
+    try:
+      with open_input(self.fname, self.mode) as fin:
+        while not self.stopped.is_set():
+          lines = fin.readlines(self.batch_bytes)
+          if not lines:
+            break
+          self._put(lines)
+    except Exception as err:
+      self._put(err)
+    # end of input
+    self._put(None)
+
+  def _put_lines(self, data, final=False):
+    '''
+      Queue the complete lines of data (all of it if final) and return the
+      partial last line. Text is split like open() does, with universal
+      newlines.
+    '''
+    end = len(data) if final else data.rfind(b'\n') + 1
+    chunk, newline = data[:end], b'\n'
+    if 'b' not in self.mode:
+      chunk = chunk.decode().replace('\r\n', '\n').replace('\r', '\n')
+      newline = '\n'
+    lines = chunk.split(newline)
+    last = lines.pop()
+    lines = [line + newline for line in lines]
+    if last:
+      lines.append(last)
+    if lines:
+      self._put(lines)
+    return data[end:]
+
+  def _read_blocks(self):
+    try:
+      with open(self.fname, 'rb') as fin, \
+          ThreadPoolExecutor(self.workers) as pool:
+        pending = collections.deque()
+        tail = b''
+        for stream in bz2_blocks(fin):
+          if self.stopped.is_set():
+            break
+          pending.append(pool.submit(bz2.decompress, stream))
+          if len(pending) >= 2 * self.workers:
+            tail = self._put_lines(tail + pending.popleft().result())
+        while pending and not self.stopped.is_set():
+          tail = self._put_lines(tail + pending.popleft().result())
+        for future in pending:
+          future.cancel()
+        self._put_lines(tail, final=True)
+    except Exception as err:
+      self._put(err)
+    self._put(None)
+
+  def __iter__(self):
+    while True:
+      self.gets += 1
+      self.queued += self.queue.qsize()
+      start = time.perf_counter()
+      lines = self.queue.get()
+      self.consumer_wait += time.perf_counter() - start
+      if lines is None:
+        return
+      if isinstance(lines, Exception):
+        raise lines
+      self.batches += 1
+      yield from lines
+
+  def close(self):
+    '''
+      Stop the reader, even if the input was not read to the end.
+    '''
+    self.stopped.set()
+    self.thread.join()
+
+  def report(self):
+    return ('{}: {:,d} batches, queue depth {:0.1f} of {} on average, ' \
+        'reader waited {:0.2f}s (queue full), consumer waited {:0.2f}s ' \
+        '(queue empty)').format(self.fname, self.batches,
+        self.queued / max(self.gets, 1), self.depth, self.reader_wait,
+        self.consumer_wait)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
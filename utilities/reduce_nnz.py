@@ -0,0 +1,298 @@
+
+import os
+import heapq
+import struct
+import tempfile
+
+from tensor_writer import open_tensor
+
+
+# How duplicate values are combined. 'count' ignores the values and counts
+# the duplicates instead.
+REDUCTIONS = {
+  'sum':   lambda a, b: a + b,
+  'count': lambda a, b: a + b,
+  'max':   max,
+  'min':   min,
+  'first': lambda a, b: a,
+}
+
+
+class NonzeroReducer:
+  '''
+    Merges duplicate nonzeros with a reduction, in bounded memory.
+
+    Indices are packed into big-endian uint64 byte strings, which are compact
+    dict keys and sort in the same order as the index tuples. Up to
+    max_entries distinct nonzeros are reduced in a dict; beyond that, the
+    dict is sorted and spilled to a run file. Iterating merges the runs and
+    yields (inds, val) in sorted index order with every duplicate reduced.
+    At most fanin runs are open at once: beyond that, runs are first merged
+    in passes of fanin runs each.
+  '''
+
+  def __init__(self, nmodes, reduce='sum', value_type='d',
+      max_entries=1 << 22, tmpdir=None, fanin=64):
+    if reduce not in REDUCTIONS:
+      raise ValueError('unknown reduction: {}'.format(reduce))
+    self.nmodes = nmodes
+    self.reduce = reduce
+    self.combine = REDUCTIONS[reduce]
+    self.value_type = 'q' if reduce == 'count' else value_type
+    self.to_value = float if self.value_type == 'd' else int
+    self.max_entries = max_entries
+    self.fanin = max(fanin, 2)
+
+    self.key = struct.Struct('>{}Q'.format(nmodes))
+    # spilled (key, value) records
+    self.record = struct.Struct('<{}s{}'.format(self.key.size, self.value_type))
+
+    self.tmpdir_parent = tmpdir
+    self.tmpdir = None
+    self.runs = []
+    self.nruns = 0
+    self.entries = {}
+    self.nnz = 0
+
+  def add(self, inds, val):
+    key = self.key.pack(*inds)
+    if self.reduce == 'count':
+      val = 1
+    else:
+      val = self.to_value(val)
+    entries = self.entries
+    old = entries.get(key)
+    if old is None:
+      entries[key] = val
+      if len(entries) >= self.max_entries:
+        self.spill()
+    else:
+      entries[key] = self.combine(old, val)
+    self.nnz += 1
+
+  def spill(self):
+    '''
+      Write the reduced entries, sorted by index, to a new run file.
+    '''
+    entries = self.entries
+    self.runs.append(self._write_run((k, entries[k]) for k in sorted(entries)))
+    self.entries = {}
+
+  def _pack(self, key, val):
+    return self.record.pack(key, val)
+
+  def _write_run(self, entries):
+    '''
+      Write (key, val) pairs, in key order, to a new run file and return its
+      name.
+    '''
+    if self.tmpdir is None:
+      self.tmpdir = tempfile.TemporaryDirectory(prefix='reduce-',
+          dir=self.tmpdir_parent)
+    fname = os.path.join(self.tmpdir.name, 'run-{}'.format(self.nruns))
+    self.nruns += 1
+    pack = self._pack
+    with open(fname, 'wb') as fout:
+      buf = []
+      for key, val in entries:
+        buf.append(pack(key, val))
+        if len(buf) == 65536:
+          fout.write(b''.join(buf))
+          buf = []
+      fout.write(b''.join(buf))
+    return fname
+
+  def _read_run(self, fname, block=4096):
+    size = self.record.size
+    with open(fname, 'rb') as fin:
+      while True:
+        buf = fin.read(size * block)
+        if not buf:
+          break
+        yield from self.record.iter_unpack(buf)
+
+  def _merge(self, runs):
+    '''
+      Merge run files into (key, val) pairs in key order, with duplicates
+      reduced.
+    '''
+    merged = heapq.merge(*map(self._read_run, runs), key=lambda rec: rec[0])
+    combine = self.combine
+    cur_key, cur_val = next(merged, (None, None))
+    for key, val in merged:
+      if key == cur_key:
+        cur_val = combine(cur_val, val)
+      else:
+        yield cur_key, cur_val
+        cur_key, cur_val = key, val
+    if cur_key is not None:
+      yield cur_key, cur_val
+
+  def _merged_runs(self):
+    '''
+      Merge the runs in passes until at most fanin are left, and return
+      them. Each merged run replaces the runs it came from.
+    '''
+    runs = self.runs
+    while len(runs) > self.fanin:
+      merged = []
+      for start in range(0, len(runs), self.fanin):
+        group = runs[start:start + self.fanin]
+        merged.append(self._write_run(self._merge(group)))
+        for fname in group:
+          os.remove(fname)
+      runs = self.runs = merged
+    return runs
+
+  def _sorted_entries(self):
+    if not self.runs:
+      entries = self.entries
+      for key in sorted(entries):
+        yield key, entries[key]
+      return
+
+    if self.entries:
+      self.spill()
+    yield from self._merge(self._merged_runs())
+
+  def __iter__(self):
+    unpack = self.key.unpack
+    for key, val in self._sorted_entries():
+      yield unpack(key), val
+    self.close()
+
+  def close(self):
+    self.entries = {}
+    if self.tmpdir is not None:
+      self.tmpdir.cleanup()
+      self.tmpdir = None
+    self.runs = []
+    self.nruns = 0
+
+
+class NonzeroSet(NonzeroReducer):
+  '''
+    NonzeroReducer for tensors whose values are all the same constant (e.g.,
+    binary tagging tensors), where a max() reduction just drops duplicates.
+    Only the packed indices are kept, in a set, and spilled runs hold bare
+    keys. Iterating yields (inds, value) for each distinct nonzero.
+  '''
+
+  def __init__(self, nmodes, value=1.0, value_type='d', max_entries=1 << 22,
+      tmpdir=None, fanin=64):
+    NonzeroReducer.__init__(self, nmodes, 'max', value_type, max_entries,
+        tmpdir, fanin)
+    self.value = self.to_value(value)
+    self.record = struct.Struct('{}s'.format(self.key.size))
+    self.entries = set()
+
+  def add(self, inds, val=None):
+    entries = self.entries
+    entries.add(self.key.pack(*inds))
+    if len(entries) >= self.max_entries:
+      self.spill()
+    self.nnz += 1
+
+  def spill(self):
+    value = self.value
+    self.runs.append(self._write_run((k, value) for k in sorted(self.entries)))
+    self.entries = set()
+
+  def _pack(self, key, val):
+    return key
+
+  def _merge(self, runs):
+    prev = None
+    for (key,) in heapq.merge(*map(self._read_run, runs)):
+      if key != prev:
+        yield key, self.value
+        prev = key
+
+  def _sorted_entries(self):
+    if not self.runs:
+      for key in sorted(self.entries):
+        yield key, self.value
+      return
+
+    if self.entries:
+      self.spill()
+    yield from self._merge(self._merged_runs())
+
+  def close(self):
+    NonzeroReducer.close(self)
+    self.entries = set()
+
+
+class ProjectionWriter:
+  '''
+    Writes a stream of full-order nonzeros to fname and, alongside it, the
+    projections of the stream onto subsets of its modes. Each projection is
+    given as (modes, fname, reduce): the 0-based modes to keep, its output
+    file, and the reduction (see REDUCTIONS) that merges the duplicates the
+    projection creates. Projections are written, sorted, on close().
+
+    fname may be None to only write projections. If every nonzero has the
+    same value (binary tensors), pass it as value: projections are then
+    stored as NonzeroSets and duplicates are simply dropped.
+  '''
+
+  def __init__(self, fname, nmodes, projections, value_type='d',
+      max_entries=1 << 22, tmpdir=None, value=None):
+    self.nmodes = nmodes
+    self.full = None
+    if fname is not None:
+      self.full = open_tensor(fname, nmodes, value_type=value_type)
+
+    self.projections = []
+    for modes, proj_fname, reduce in projections:
+      if value is None:
+        reducer = NonzeroReducer(len(modes), reduce, value_type, max_entries,
+            tmpdir)
+      else:
+        reducer = NonzeroSet(len(modes), value, value_type, max_entries,
+            tmpdir)
+      self.projections.append((tuple(modes), proj_fname, reducer))
+    self.writers = []
+
+  def write(self, *nnz):
+    if self.full is not None:
+      self.full.write(*nnz)
+    val = nnz[-1]
+    for modes, _, reducer in self.projections:
+      reducer.add([nnz[m] for m in modes], val)
+
+  def write_columns(self, inds, vals):
+    '''
+      Write len(vals) nonzeros, given as one sequence of indices per mode
+      and a sequence of values.
+    '''
+    if self.full is not None:
+      self.full.write_columns(inds, vals)
+    for modes, _, reducer in self.projections:
+      for row, val in zip(zip(*[inds[m] for m in modes]), vals):
+        reducer.add(row, val)
+
+  def close(self):
+    if self.full is not None:
+      self.full.close()
+    for modes, fname, reducer in self.projections:
+      with open_tensor(fname, len(modes), value_type=reducer.value_type) as fout:
+        for inds, val in reducer:
+          fout.write(*inds, val)
+      self.writers.append(fout)
+    self.projections = []
+
+  def report(self):
+    '''
+      One line per output tensor, as returned by TensorWriter.report().
+    '''
+    writers = self.writers
+    if self.full is not None:
+      writers = [self.full] + writers
+    return '\n'.join(w.report() for w in writers)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
@@ -1,120 +1,895 @@
+/*
+ * Build with: g++ -O2 -std=c++11 -pthread remove_dups.cc -o remove_dups
+ */
 
 #include <iostream>
-#include <fstream>
 #include <string>
+#include <vector>
+#include <thread>
+#include <chrono>
+#include <functional>
+#include <cmath>
+#include <cstdio>
 #include <cstdlib>
+#include <cstring>
+#include <stdint.h>
+
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 using namespace std;
 
-int const MAX_NMODES = 1024;
+/* bytes of text input parsed by each thread per round */
+#ifndef SEGMENT_BYTES
+#define SEGMENT_BYTES (1 << 26)
+#endif
 
 
 struct nonzero
 {
-  size_t inds[MAX_NMODES];
+  vector<uint64_t> inds;
   double   val;
 };
 
 
-inline void read_nnz(
-    ifstream & fin,
+/*
+ * How duplicates are combined. COUNT replaces the values with the number of
+ * times each nonzero appears.
+ */
+enum reduction
+{
+  REDUCE_SUM,
+  REDUCE_MAX,
+  REDUCE_MIN,
+  REDUCE_COUNT,
+  REDUCE_FIRST
+};
+
+static bool parse_reduction(
+    char const * const name,
+    reduction & op)
+{
+  char const * const names[] = {"sum", "max", "min", "count", "first"};
+  for(int r=0; r < 5; ++r) {
+    if(strcmp(name, names[r]) == 0) {
+      op = (reduction) r;
+      return true;
+    }
+  }
+  return false;
+}
+
+inline double reduce(
+    reduction const op,
+    double const a,
+    double const b)
+{
+  switch(op) {
+  case REDUCE_MAX:
+    return a > b ? a : b;
+  case REDUCE_MIN:
+    return a < b ? a : b;
+  case REDUCE_FIRST:
+    return a;
+  default:
+    return a + b;
+  }
+}
+
+
+/*
+ * Input tensors are memory-mapped. Binary COO tensors (see bin_tensor.py)
+ * are read straight out of their index/value columns; anything else is
+ * parsed as .tns text.
+ */
+char const BIN_MAGIC[8] = {'F', 'R', 'O', 'S', 'T', 'T', 'B', '1'};
+
+struct tensor_reader
+{
+  char const * map;
+  size_t map_len;
+
+  bool binary;
+  uint64_t nnz;
+  unsigned index_width;
+  char value_type;
+  vector<unsigned char const *> cols;
+  unsigned char const * vals;
+};
+
+
+/*
+ * A range of the input: bytes [pos, end) of a text tensor, or nonzeros
+ * [next, stop) of a binary one. Text segments always start and end on line
+ * boundaries.
+ */
+struct segment
+{
+  char const * pos;
+  char const * end;
+  uint64_t next;
+  uint64_t stop;
+};
+
+
+static bool open_input(
+    tensor_reader & reader,
+    char const * const fname,
+    int const nmodes)
+{
+  int fd = open(fname, O_RDONLY);
+  if(fd < 0) {
+    return false;
+  }
+  struct stat st;
+  fstat(fd, &st);
+  reader.map = NULL;
+  reader.map_len = st.st_size;
+  reader.binary = false;
+  if(reader.map_len == 0) {
+    close(fd);
+    return true;
+  }
+
+  void * map = mmap(NULL, reader.map_len, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+  if(map == MAP_FAILED) {
+    return false;
+  }
+  madvise(map, reader.map_len, MADV_SEQUENTIAL);
+  reader.map = (char const *) map;
+
+  size_t const header_len = 24;
+  unsigned char const * bytes = (unsigned char const *) map;
+  if(reader.map_len < header_len ||
+      memcmp(bytes, BIN_MAGIC, sizeof(BIN_MAGIC)) != 0) {
+    return true;
+  }
+
+  uint32_t file_nmodes;
+  memcpy(&file_nmodes, bytes + 8, sizeof(file_nmodes));
+  if((int) file_nmodes != nmodes) {
+    cout << fname << " has " << file_nmodes << " modes, not " << nmodes << endl;
+    exit(1);
+  }
+
+  reader.binary = true;
+  reader.index_width = bytes[12];
+  reader.value_type = (char) bytes[13];
+  memcpy(&reader.nnz, bytes + 16, sizeof(reader.nnz));
+
+  size_t offset = header_len + 8 * nmodes;
+  reader.cols.resize(nmodes);
+  for(int m=0; m < nmodes; ++m) {
+    reader.cols[m] = bytes + offset;
+    offset += reader.nnz * reader.index_width;
+  }
+  offset += (8 - (offset % 8)) % 8;
+  reader.vals = bytes + offset;
+  return true;
+}
+
+
+/*
+ * Cut the input, from where cursor left off, into up to nsegs segments of
+ * about seg_bytes each. Returns false once the input is exhausted.
+ */
+static bool next_segments(
+    tensor_reader const & reader,
+    segment & cursor,
+    vector<segment> & segs,
+    int const nsegs,
+    size_t const seg_bytes,
+    int const nmodes)
+{
+  segs.clear();
+  for(int s=0; s < nsegs; ++s) {
+    segment seg = cursor;
+    if(reader.binary) {
+      if(cursor.next == cursor.stop) {
+        break;
+      }
+      uint64_t const seg_nnz = seg_bytes / (nmodes * reader.index_width + 8);
+      seg.stop = min(cursor.stop, cursor.next + max(seg_nnz, (uint64_t) 1));
+      cursor.next = seg.stop;
+    } else {
+      if(cursor.pos == cursor.end) {
+        break;
+      }
+      if((size_t) (cursor.end - cursor.pos) <= seg_bytes) {
+        seg.end = cursor.end;
+      } else {
+        char const * nl = (char const *) memchr(cursor.pos + seg_bytes, '\n',
+            cursor.end - (cursor.pos + seg_bytes));
+        seg.end = (nl == NULL) ? cursor.end : nl + 1;
+      }
+      cursor.pos = seg.end;
+    }
+    segs.push_back(seg);
+  }
+  return !segs.empty();
+}
+
+
+static void parse_error(
+    char const * const p,
+    char const * const end)
+{
+  char const * nl = (char const *) memchr(p, '\n', end - p);
+  cout << "could not parse line: '" << string(p, nl ? nl : end) << "'" << endl;
+  exit(1);
+}
+
+inline bool is_space(
+    char const c)
+{
+  return c == ' ' || c == '\t' || c == '\r';
+}
+
+/*
+ * Parse a value. Plain decimals with up to 15 significant digits are
+ * converted exactly (the mantissa and the power of ten are both exact
+ * doubles, so one division rounds correctly); anything else goes through
+ * strtod.
+ */
+inline char const * parse_value(
+    char const * p,
+    char const * const end,
+    double & val)
+{
+  static double const pow10[] = {1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7,
+      1e8, 1e9, 1e10, 1e11, 1e12, 1e13, 1e14, 1e15};
+
+  char const * const start = p;
+  bool const neg = (p < end && *p == '-');
+  if(neg) {
+    ++p;
+  }
+  uint64_t mant = 0;
+  int ndigits = 0;
+  int nfrac = 0;
+  while(p < end && *p >= '0' && *p <= '9') {
+    mant = mant * 10 + (*p++ - '0');
+    ++ndigits;
+  }
+  if(p < end && *p == '.') {
+    ++p;
+    while(p < end && *p >= '0' && *p <= '9') {
+      mant = mant * 10 + (*p++ - '0');
+      ++ndigits;
+      ++nfrac;
+    }
+  }
+  if(ndigits > 0 && ndigits <= 15 && (p == end || is_space(*p) || *p == '\n')) {
+    val = (double) mant / pow10[nfrac];
+    if(neg) {
+      val = -val;
+    }
+    return p;
+  }
+
+  /* slow path: copy the token so that strtod cannot run off the map */
+  p = start;
+  char tok[64];
+  size_t len = 0;
+  while(p < end && !is_space(*p) && *p != '\n' && len < sizeof(tok) - 1) {
+    tok[len++] = *p++;
+  }
+  tok[len] = '\0';
+  char * tok_end;
+  val = strtod(tok, &tok_end);
+  if(len == 0 || tok_end != tok + len) {
+    parse_error(start, end);
+  }
+  return p;
+}
+
+inline bool read_text_nnz(
+    segment & seg,
+    nonzero & nnz,
+    int const nmodes)
+{
+  char const * p = seg.pos;
+  char const * const end = seg.end;
+  while(p < end) {
+    /* skip blank lines and comments */
+    if(is_space(*p) || *p == '\n') {
+      ++p;
+      continue;
+    }
+    if(*p == '#') {
+      char const * nl = (char const *) memchr(p, '\n', end - p);
+      p = (nl == NULL) ? end : nl + 1;
+      continue;
+    }
+
+    char const * const line = p;
+    for(int m=0; m < nmodes; ++m) {
+      while(p < end && is_space(*p)) {
+        ++p;
+      }
+      if(p == end || *p < '0' || *p > '9') {
+        parse_error(line, end);
+      }
+      uint64_t ind = 0;
+      while(p < end && *p >= '0' && *p <= '9') {
+        ind = ind * 10 + (*p++ - '0');
+      }
+      nnz.inds[m] = ind;
+    }
+    while(p < end && is_space(*p)) {
+      ++p;
+    }
+    p = parse_value(p, end, nnz.val);
+
+    /* anything left on the line is ignored */
+    char const * nl = (char const *) memchr(p, '\n', end - p);
+    seg.pos = (nl == NULL) ? end : nl + 1;
+    return true;
+  }
+  seg.pos = end;
+  return false;
+}
+
+inline bool read_binary_nnz(
+    tensor_reader const & reader,
+    segment & seg,
     nonzero & nnz,
     int const nmodes)
 {
+  if(seg.next == seg.stop) {
+    return false;
+  }
+  uint64_t const n = seg.next++;
   for(int m=0; m < nmodes; ++m) {
-    fin >> nnz.inds[m];
+    if(reader.index_width == 4) {
+      uint32_t ind;
+      memcpy(&ind, reader.cols[m] + n * 4, 4);
+      nnz.inds[m] = ind;
+    } else {
+      uint64_t ind;
+      memcpy(&ind, reader.cols[m] + n * 8, 8);
+      nnz.inds[m] = ind;
+    }
   }
-  fin >> nnz.val;
+  if(reader.value_type == 'q') {
+    int64_t val;
+    memcpy(&val, reader.vals + n * 8, 8);
+    nnz.val = (double) val;
+  } else {
+    memcpy(&nnz.val, reader.vals + n * 8, 8);
+  }
+  return true;
 }
 
-inline void write_nnz(
-    ofstream & fout,
+inline bool read_nnz(
+    tensor_reader const & reader,
+    segment & seg,
     nonzero & nnz,
+    int const nmodes,
+    reduction const op)
+{
+  bool const found = reader.binary ? read_binary_nnz(reader, seg, nnz, nmodes)
+                                   : read_text_nnz(seg, nnz, nmodes);
+  if(found && op == REDUCE_COUNT) {
+    nnz.val = 1.;
+  }
+  return found;
+}
+
+
+/*
+ * Output is formatted into large in-memory buffers and written with one
+ * fwrite() each, instead of one stream insertion (and flush) per line.
+ * Values are printed as "%g", which is what "fout << val" produced.
+ */
+struct out_buffer
+{
+  vector<char> buf;
+  size_t len;
+};
+
+static void buffer_init(
+    out_buffer & out,
+    size_t const capacity)
+{
+  out.buf.resize(capacity);
+  out.len = 0;
+}
+
+static void buffer_flush(
+    out_buffer & out,
+    FILE * fout)
+{
+  if(out.len > 0 && fwrite(out.buf.data(), 1, out.len, fout) != out.len) {
+    cout << "error writing output" << endl;
+    exit(1);
+  }
+  out.len = 0;
+}
+
+inline void write_nnz(
+    out_buffer & out,
+    uint64_t const * const inds,
+    double const val,
     int const nmodes)
 {
+  /* worst case: 20 digits and a space per index, plus the value */
+  size_t const need = 21 * nmodes + 64;
+  if(out.len + need > out.buf.size()) {
+    out.buf.resize(2 * out.buf.size() + need);
+  }
+  char * p = out.buf.data() + out.len;
   for(int m=0; m < nmodes; ++m) {
-    fout << nnz.inds[m] << " ";
+    char digits[20];
+    int nd = 0;
+    uint64_t ind = inds[m];
+    do {
+      digits[nd++] = '0' + (ind % 10);
+      ind /= 10;
+    } while(ind > 0);
+    while(nd > 0) {
+      *p++ = digits[--nd];
+    }
+    *p++ = ' ';
+  }
+  if(val > -1e6 && val < 1e6 && val == (double) (int64_t) val &&
+      !(val == 0. && signbit(val))) {
+    /* integral values print the same as with %g */
+    p += sprintf(p, "%lld\n", (long long) val);
+  } else {
+    p += sprintf(p, "%g\n", val);
   }
-  fout << nnz.val << endl;
+  out.len = p - out.buf.data();
 }
 
 
+/*
+ * Open-addressing hash table of distinct nonzeros. Indices are stored
+ * packed, nmodes words per nonzero, next to a parallel array of values;
+ * slots hold positions in those arrays.
+ */
+size_t const EMPTY_SLOT = (size_t) -1;
 
-int main(int argc, char ** argv)
+struct nnz_table
 {
-  nonzero buf[2];
-  int prev = 0;
-  int curr = 1;
+  int nmodes;
+  vector<uint64_t> inds;
+  vector<double> vals;
+  vector<size_t> slots;
+};
 
-  if(argc != 4) {
-    cout << "usage: " << argv[0] << " <tensor> <nmodes> <output.tns>" << endl;
-    cout << "NOTE: <tensor> MUST be sorted before running this program." << endl;
-    return 1;
+inline uint64_t hash_inds(
+    uint64_t const * const inds,
+    int const nmodes)
+{
+  uint64_t h = 0x9e3779b97f4a7c15ULL;
+  for(int m=0; m < nmodes; ++m) {
+    h ^= inds[m] + 0x9e3779b97f4a7c15ULL + (h << 6) + (h >> 2);
   }
+  /* final avalanche (splitmix64) */
+  h ^= h >> 30;
+  h *= 0xbf58476d1ce4e5b9ULL;
+  h ^= h >> 27;
+  h *= 0x94d049bb133111ebULL;
+  h ^= h >> 31;
+  return h;
+}
 
-  ifstream fin(argv[1]);
-  if(!fin) {
-    cout << "could not open " << argv[1] << endl;
-    return 1;
+static void table_init(
+    nnz_table & table,
+    int const nmodes)
+{
+  table.nmodes = nmodes;
+  table.inds.clear();
+  table.vals.clear();
+  table.slots.assign(1024, EMPTY_SLOT);
+}
+
+static void table_grow(
+    nnz_table & table)
+{
+  int const nmodes = table.nmodes;
+  table.slots.assign(table.slots.size() * 2, EMPTY_SLOT);
+  size_t const mask = table.slots.size() - 1;
+  for(size_t n=0; n < table.vals.size(); ++n) {
+    size_t s = hash_inds(&table.inds[n * nmodes], nmodes) & mask;
+    while(table.slots[s] != EMPTY_SLOT) {
+      s = (s + 1) & mask;
+    }
+    table.slots[s] = n;
   }
+}
 
-  ofstream fout(argv[3]);
-  if(!fout) {
-    cout << "could not open " << argv[3] << endl;
-    return 1;
+/*
+ * Add a nonzero to the table, reducing it into an existing entry. Returns
+ * true if it was a duplicate.
+ */
+inline bool table_add(
+    nnz_table & table,
+    uint64_t const * const inds,
+    double const val,
+    reduction const op)
+{
+  int const nmodes = table.nmodes;
+  size_t const mask = table.slots.size() - 1;
+  size_t s = hash_inds(inds, nmodes) & mask;
+  while(table.slots[s] != EMPTY_SLOT) {
+    size_t const n = table.slots[s];
+    if(memcmp(&table.inds[n * nmodes], inds, nmodes * sizeof(*inds)) == 0) {
+      table.vals[n] = reduce(op, table.vals[n], val);
+      return true;
+    }
+    s = (s + 1) & mask;
   }
 
-  int const nmodes = atoi(argv[2]);
+  table.slots[s] = table.vals.size();
+  table.inds.insert(table.inds.end(), inds, inds + nmodes);
+  table.vals.push_back(val);
+  /* keep the load factor under 1/2 */
+  if(table.vals.size() * 2 > table.slots.size()) {
+    table_grow(table);
+  }
+  return false;
+}
 
-  /* prime loop */
-  read_nnz(fin, buf[prev], nmodes);
-  read_nnz(fin, buf[curr], nmodes);
+static void table_write(
+    nnz_table & table,
+    out_buffer & out,
+    FILE * fout)
+{
+  int const nmodes = table.nmodes;
+  for(size_t n=0; n < table.vals.size(); ++n) {
+    write_nnz(out, &table.inds[n * nmodes], table.vals[n], nmodes);
+    if(out.len > (1 << 24)) {
+      buffer_flush(out, fout);
+    }
+  }
+  buffer_flush(out, fout);
+}
 
-  size_t seen = 1;
-  size_t pruned = 0;
 
-  bool duplicate = true;
+/*
+ * The result of merging the adjacent duplicates of one segment. The first
+ * and last distinct nonzeros are held back unformatted, because they may
+ * continue duplicate runs from the neighbouring segments; everything in
+ * between is already formatted in body.
+ */
+struct segment_result
+{
+  bool empty;
+  bool single;
+  nonzero head;
+  nonzero tail;
+  out_buffer body;
+  size_t seen;
+  size_t pruned;
+};
+
+static void merge_segment(
+    tensor_reader const & reader,
+    segment seg,
+    int const nmodes,
+    reduction const op,
+    segment_result & res)
+{
+  res.seen = 0;
+  res.pruned = 0;
+  res.body.len = 0;
+  res.head.inds.resize(nmodes);
+  res.tail.inds.resize(nmodes);
 
-  while(fin) {
-    duplicate = true;
+  nonzero next;
+  next.inds.resize(nmodes);
+  nonzero & curr = res.tail;
 
+  res.empty = !read_nnz(reader, seg, curr, nmodes, op);
+  if(res.empty) {
+    return;
+  }
+  res.seen = 1;
+  bool have_head = false;
+
+  while(read_nnz(reader, seg, next, nmodes, op)) {
     /* check for duplicate nnz */
-    for(int m=0; m < nmodes; ++m) {
+    if(curr.inds == next.inds) {
+      curr.val = reduce(op, curr.val, next.val);
+      ++res.pruned;
+    } else {
       /* not a dup, so flush */
-      if(buf[prev].inds[m] != buf[curr].inds[m]) {
-        duplicate = false;
-        break;
+      if(!have_head) {
+        res.head.inds.swap(curr.inds);
+        res.head.val = curr.val;
+        have_head = true;
+      } else {
+        write_nnz(res.body, curr.inds.data(), curr.val, nmodes);
       }
+      curr.inds.swap(next.inds);
+      curr.val = next.val;
     }
+    ++res.seen;
+  }
 
-    if(duplicate) {
-      buf[prev].val += buf[curr].val;
-      ++pruned;
-    } else {
-      write_nnz(fout, buf[prev], nmodes);
+  res.single = !have_head;
+  if(res.single) {
+    res.head.inds = curr.inds;
+    res.head.val = curr.val;
+  }
+}
+
+
+/*
+ * Merge adjacent duplicates of a sorted tensor. The input is processed in
+ * rounds of nthreads segments, which are merged in parallel and then
+ * stitched together in order.
+ */
+static void remove_sorted(
+    tensor_reader const & reader,
+    segment cursor,
+    FILE * fout,
+    int const nmodes,
+    reduction const op,
+    int const nthreads,
+    size_t & seen,
+    size_t & pruned)
+{
+  size_t const seg_bytes = SEGMENT_BYTES;
+
+  /* size each body for the input of the segment its thread gets first; it
+   * grows on demand if formatting takes more */
+  size_t input_bytes;
+  if(reader.binary) {
+    input_bytes = (cursor.stop - cursor.next) *
+        (nmodes * reader.index_width + 8);
+  } else {
+    input_bytes = cursor.end - cursor.pos;
+  }
+  vector<segment_result> results(nthreads);
+  for(int t=0; t < nthreads; ++t) {
+    size_t const before = min((size_t) t * seg_bytes, input_bytes);
+    buffer_init(results[t].body,
+        min(seg_bytes, input_bytes - before) + (1 << 16));
+  }
+  out_buffer out;
+  buffer_init(out, 1 << 16);
+
+  nonzero carry;
+  carry.val = 0.;
+  bool have_carry = false;
+
+  vector<segment> segs;
+  while(next_segments(reader, cursor, segs, nthreads, seg_bytes, nmodes)) {
+    int const nsegs = segs.size();
+    vector<thread> threads;
+    for(int t=1; t < nsegs; ++t) {
+      threads.push_back(thread(merge_segment, cref(reader), segs[t], nmodes,
+          op, ref(results[t])));
+    }
+    merge_segment(reader, segs[0], nmodes, op, results[0]);
+    for(size_t t=0; t < threads.size(); ++t) {
+      threads[t].join();
+    }
+
+    /* stitch duplicate runs which cross segment boundaries */
+    for(int t=0; t < nsegs; ++t) {
+      segment_result & res = results[t];
+      if(res.empty) {
+        continue;
+      }
+      seen += res.seen;
+      pruned += res.pruned;
+
+      if(have_carry) {
+        if(carry.inds == res.head.inds) {
+          res.head.val = reduce(op, carry.val, res.head.val);
+          ++pruned;
+        } else {
+          write_nnz(out, carry.inds.data(), carry.val, nmodes);
+        }
+      }
+      if(res.single) {
+        carry.inds.swap(res.head.inds);
+        carry.val = res.head.val;
+      } else {
+        write_nnz(out, res.head.inds.data(), res.head.val, nmodes);
+        buffer_flush(out, fout);
+        buffer_flush(res.body, fout);
+        carry.inds.swap(res.tail.inds);
+        carry.val = res.tail.val;
+      }
+      have_carry = true;
+    }
+  }
+
+  /* final flush */
+  if(have_carry) {
+    write_nnz(out, carry.inds.data(), carry.val, nmodes);
+  }
+  buffer_flush(out, fout);
+}
+
+
+/*
+ * Merge duplicates of an unsorted tensor by hashing. With more than one
+ * partition, nonzeros are first split by hash into temporary files next to
+ * the output, so that only one partition's table is in memory at a time.
+ * Output follows the order in which nonzeros first appear in each
+ * partition.
+ */
+static void remove_hashed(
+    tensor_reader const & reader,
+    segment seg,
+    FILE * fout,
+    char const * const out_fname,
+    int const nmodes,
+    reduction const op,
+    int const npartitions,
+    size_t & seen,
+    size_t & pruned)
+{
+  nnz_table table;
+  table_init(table, nmodes);
+  out_buffer out;
+  buffer_init(out, 1 << 24);
+
+  nonzero nnz;
+  nnz.inds.resize(nmodes);
 
-      /* swap buffers */
-      prev = (prev + 1) % 2;
-      curr = (curr + 1) % 2;
+  if(npartitions == 1) {
+    while(read_nnz(reader, seg, nnz, nmodes, op)) {
+      pruned += table_add(table, nnz.inds.data(), nnz.val, op);
+      ++seen;
     }
+    table_write(table, out, fout);
+    return;
+  }
 
+  /* split by hash into partition files of packed (inds, val) records */
+  vector<string> part_names(npartitions);
+  vector<FILE *> parts(npartitions);
+  for(int p=0; p < npartitions; ++p) {
+    part_names[p] = string(out_fname) + ".part-" + to_string(p);
+    parts[p] = fopen(part_names[p].c_str(), "wb");
+    if(parts[p] == NULL) {
+      cout << "could not open " << part_names[p] << endl;
+      exit(1);
+    }
+  }
+  while(read_nnz(reader, seg, nnz, nmodes, op)) {
+    /* partition on the high bits, the table uses the low bits */
+    int const p = (hash_inds(nnz.inds.data(), nmodes) >> 32) % npartitions;
+    fwrite(nnz.inds.data(), sizeof(uint64_t), nmodes, parts[p]);
+    fwrite(&nnz.val, sizeof(nnz.val), 1, parts[p]);
     ++seen;
-    /* parse the next line */
-    read_nnz(fin, buf[curr], nmodes);
   }
 
-  fin.close();
+  for(int p=0; p < npartitions; ++p) {
+    fclose(parts[p]);
+    FILE * fin = fopen(part_names[p].c_str(), "rb");
+    while(fread(nnz.inds.data(), sizeof(uint64_t), nmodes, fin) ==
+        (size_t) nmodes && fread(&nnz.val, sizeof(nnz.val), 1, fin) == 1) {
+      pruned += table_add(table, nnz.inds.data(), nnz.val, op);
+    }
+    fclose(fin);
+    remove(part_names[p].c_str());
+
+    table_write(table, out, fout);
+    table_init(table, nmodes);
+  }
+}
+
+
+
+static void usage(
+    char const * const name)
+{
+  cout << "usage: " << name << " <tensor> <nmodes> <output.tns> [options]" << endl;
+  cout << "<tensor> may be .tns text or a binary tensor." << endl;
+  cout << endl;
+  cout << "By default <tensor> MUST be sorted (e.g., with sort_tns.py) and" << endl;
+  cout << "adjacent duplicates are merged." << endl;
+  cout << endl;
+  cout << "options:" << endl;
+  cout << "  --hash             merge duplicates of unsorted input by hashing" << endl;
+  cout << "  --partitions=N     split --hash input into N partitions on disk" << endl;
+  cout << "                     to bound memory (default: 1)" << endl;
+  cout << "  --reduce=OP        sum (default), max, min, count, or first" << endl;
+  cout << "  --threads=N        threads for sorted input (default: all cores)" << endl;
+}
+
+
+int main(int argc, char ** argv)
+{
+  if(argc < 4) {
+    usage(argv[0]);
+    return 1;
+  }
+
+  int const nmodes = atoi(argv[2]);
+  if(nmodes < 1) {
+    cout << "nmodes must be positive" << endl;
+    return 1;
+  }
+
+  bool hashed = false;
+  int npartitions = 1;
+  int nthreads = max((int) thread::hardware_concurrency(), 1);
+  reduction op = REDUCE_SUM;
+  for(int a=4; a < argc; ++a) {
+    string const arg(argv[a]);
+    if(arg == "--hash") {
+      hashed = true;
+    } else if(arg.compare(0, 13, "--partitions=") == 0) {
+      npartitions = atoi(arg.c_str() + 13);
+      hashed = true;
+      if(npartitions < 1) {
+        cout << "--partitions must be positive" << endl;
+        return 1;
+      }
+    } else if(arg.compare(0, 10, "--threads=") == 0) {
+      nthreads = atoi(arg.c_str() + 10);
+      if(nthreads < 1) {
+        cout << "--threads must be positive" << endl;
+        return 1;
+      }
+    } else if(arg.compare(0, 9, "--reduce=") == 0) {
+      if(!parse_reduction(arg.c_str() + 9, op)) {
+        cout << "unknown reduction: " << arg.c_str() + 9 << endl;
+        return 1;
+      }
+    } else {
+      usage(argv[0]);
+      return 1;
+    }
+  }
+
+  chrono::steady_clock::time_point const start = chrono::steady_clock::now();
+
+  tensor_reader reader;
+  if(!open_input(reader, argv[1], nmodes)) {
+    cout << "could not open " << argv[1] << endl;
+    return 1;
+  }
+  segment all;
+  all.pos = reader.map;
+  all.end = reader.map + reader.map_len;
+  all.next = 0;
+  all.stop = reader.binary ? reader.nnz : 0;
+
+  FILE * fout = fopen(argv[3], "w");
+  if(fout == NULL) {
+    cout << "could not open " << argv[3] << endl;
+    return 1;
+  }
+  setvbuf(fout, NULL, _IOFBF, 1 << 22);
+
+  size_t seen = 0;
+  size_t pruned = 0;
 
-  /* final flush if we ended on a duplicate */
-  if(duplicate) {
-    write_nnz(fout, buf[prev], nmodes);
+  if(hashed) {
+    remove_hashed(reader, all, fout, argv[3], nmodes, op, npartitions, seen,
+        pruned);
+  } else {
+    remove_sorted(reader, all, fout, nmodes, op, nthreads, seen, pruned);
   }
 
-  fout.close();
+  if(reader.map != NULL) {
+    munmap((void *) reader.map, reader.map_len);
+  }
+
+  if(fclose(fout) != 0) {
+    cout << "error writing " << argv[3] << endl;
+    return 1;
+  }
   cout << "nnz: " << seen << " pruned: " << pruned << endl;
   cout << "new nnz: " << seen - pruned << endl;
 
+  double const secs = chrono::duration<double>(
+      chrono::steady_clock::now() - start).count();
+  fprintf(stdout, "time: %0.3fs  %0.0f nnz/s  %0.1f MB/s\n", secs,
+      seen / max(secs, 1e-9), reader.map_len / max(secs, 1e-9) / 1e6);
+
   return 0;
 }
-
-
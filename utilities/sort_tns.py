@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import heapq
+import struct
+import argparse
+import tempfile
+import multiprocessing
+
+from parallel_compress import open_output
+from tns_reader import chunk_ranges, count_modes, read_range
+
+
+my_description = '''
+Sort the nonzeros of a .tns file by their indices, compared as integers.
+The output is ready for remove_dups, which requires sorted input.
+
+Nonzeros are ordered by the modes given with --order (1-indexed, e.g.
+"--order 3,1,2"); modes left out are appended in their natural order, so
+that duplicate nonzeros are always adjacent. Lines are copied through
+unchanged and comments and blank lines are dropped.
+
+The input is cut into chunks which worker processes parse and sort in
+parallel. Sorted chunks are spilled to run files and merged, at most
+--fanin runs at a time, so the memory use and the number of open files are
+bounded regardless of the tensor size. The output is compressed if its name
+ends in .bz2, .gz, or .xz.
+'''
+
+
+# Parsed lines take several times their text size in memory.
+PARSED_FACTOR = 8
+
+# Chunks that --memory is split into. At most this many are sorted at once,
+# however many workers there are.
+MAX_CHUNKS_IN_FLIGHT = 16
+
+
+def sort_chunk(fname, start, length, order, run_fname):
+  '''
+    Sort the lines of a byte range of fname by the indices in order
+    (0-based) and write them to run_fname. Each record is a big-endian
+    packed key, which sorts like the index tuple, followed by the original
+    line. Returns the number of nonzeros in the run.
+  '''
+  key = struct.Struct('>{}Q'.format(len(order))).pack
+  records = []
+  for line in read_range(fname, start, length).splitlines(True):
+    fields = line.split()
+    # skip comments and blank lines
+    if not fields or fields[0][:1] == b'#':
+      continue
+    if line[-1:] != b'\n':
+      line += b'\n'
+    records.append((key(*[int(fields[m]) for m in order]), line))
+  records.sort()
+
+  with open(run_fname, 'wb') as fout:
+    for start in range(0, len(records), 65536):
+      fout.write(b''.join(k + line for k, line in records[start:start+65536]))
+  return len(records)
+
+
+def read_run(fname, key_size, buffering=1 << 20):
+  with open(fname, 'rb', buffering=buffering) as fin:
+    while True:
+      key = fin.read(key_size)
+      if not key:
+        break
+      yield key, fin.readline()
+
+
+def merge_runs(run_fnames, key_size, buffering):
+  '''
+    Merge sorted run files into one sorted stream of (key, line) records.
+  '''
+  return heapq.merge(*[read_run(r, key_size, buffering) for r in run_fnames])
+
+
+def merge_to_run(run_fnames, key_size, buffering, out_fname):
+  '''
+    Merge sorted run files into a new run file, and delete them.
+  '''
+  with open(out_fname, 'wb', buffering=buffering) as fout:
+    buf = []
+    for key, line in merge_runs(run_fnames, key_size, buffering):
+      buf.append(key + line)
+      if len(buf) == 65536:
+        fout.write(b''.join(buf))
+        buf = []
+    fout.write(b''.join(buf))
+  for fname in run_fnames:
+    os.remove(fname)
+
+
+def run_buffer(memory, nopen):
+  '''
+    Read buffer size for each of nopen runs, so that all of them fit in half
+    of memory MB.
+  '''
+  return max((memory << 20) // (2 * nopen), 1 << 16)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=my_description,
+      formatter_class=argparse.RawTextHelpFormatter)
+
+  parser.add_argument('tensor', type=str, help='tensor to sort (.tns)')
+  parser.add_argument('output', type=str, help='sorted tensor')
+  parser.add_argument('--order', type=str, default=None,
+      help='comma-separated mode order, 1-indexed (default: 1,2,...)')
+  parser.add_argument('--workers', type=int, default=os.cpu_count(),
+      help='number of sorting processes (default: all cores)')
+  parser.add_argument('--memory', type=int, default=2048,
+      help='approximate memory limit in MB (default: 2048)')
+  parser.add_argument('--tmpdir', type=str, default=None,
+      help='directory for spilled runs (default: next to the output)')
+  parser.add_argument('--fanin', type=int, default=64,
+      help='maximum number of runs merged at once (default: 64)')
+
+  args = parser.parse_args()
+
+  nmodes = count_modes(args.tensor)
+  if nmodes == 0:
+    print('{}: no nonzeros found'.format(args.tensor))
+    sys.exit(1)
+
+  order = []
+  if args.order:
+    order = [int(m) - 1 for m in args.order.split(',')]
+    if len(set(order)) != len(order) or \
+        any(m < 0 or m >= nmodes for m in order):
+      print('--order must list distinct modes in [1, {}]'.format(nmodes))
+      sys.exit(1)
+  order += [m for m in range(nmodes) if m not in order]
+  print('sorting by modes {}'.format(','.join(str(m+1) for m in order)))
+
+  # The chunk size depends on --memory alone, so that adding workers does
+  # not add runs. Up to two chunks per worker are in flight, but no more than
+  # fit in --memory.
+  workers = max(args.workers, 1)
+  chunk_bytes = max((args.memory << 20) //
+      (PARSED_FACTOR * MAX_CHUNKS_IN_FLIGHT), 1 << 16)
+  in_flight = min(2 * workers, MAX_CHUNKS_IN_FLIGHT)
+  fanin = max(args.fanin, 2)
+  key_size = 8 * nmodes
+
+  tmpdir = tempfile.TemporaryDirectory(prefix='sort-',
+      dir=args.tmpdir or os.path.dirname(os.path.abspath(args.output)))
+  runs = []
+  nnz = 0
+  with multiprocessing.Pool(workers) as pool:
+    pending = []
+    for start, length in chunk_ranges(args.tensor, chunk_bytes):
+      run_fname = os.path.join(tmpdir.name, 'run-{}'.format(len(runs)))
+      runs.append(run_fname)
+      pending.append(pool.apply_async(sort_chunk,
+          (args.tensor, start, length, order, run_fname)))
+      # bound the number of chunks in memory
+      while len(pending) >= in_flight:
+        nnz += pending.pop(0).get()
+    for result in pending:
+      nnz += result.get()
+
+    print('sorted {:,d} nnz in {} runs'.format(nnz, len(runs)))
+
+    # Merge groups of fanin runs into longer runs, in parallel, until one
+    # merge of the rest writes the output.
+    npasses = 0
+    while len(runs) > fanin:
+      groups = [runs[i:i + fanin] for i in range(0, len(runs), fanin)]
+      runs = [os.path.join(tmpdir.name, 'pass-{}-{}'.format(npasses, g))
+          for g in range(len(groups))]
+      buffering = run_buffer(args.memory,
+          (fanin + 1) * min(workers, len(groups)))
+      pool.starmap(merge_to_run, [(group, key_size, buffering, out_fname)
+          for group, out_fname in zip(groups, runs)], chunksize=1)
+      npasses += 1
+      print('merge pass {}: {} runs'.format(npasses, len(runs)))
+
+  with open_output(args.output, 'wb') as fout:
+    merged = merge_runs(runs, key_size, run_buffer(args.memory, len(runs)))
+    buf = []
+    for _, line in merged:
+      buf.append(line)
+      if len(buf) == 65536:
+        fout.write(b''.join(buf))
+        buf = []
+    fout.write(b''.join(buf))
+
+  tmpdir.cleanup()
@@ -0,0 +1,127 @@
+
+import os
+import time
+from itertools import chain
+
+from parallel_compress import compressed_name, open_output
+
+
+def open_tensor(fname, nmodes, **kwargs):
+  '''
+    Open a writer for fname. Names ending in ".bin" get the binary COO format
+    of bin_tensor.py. Setting TNS_FORMAT=bin in the environment switches
+    ".tns" outputs to binary as well, without editing each parser.
+
+    Text tensors are compressed while writing if fname ends in .bz2, .gz, or
+    .xz, or if TNS_COMPRESS is set (see parallel_compress.py). Binary tensors
+    are never compressed, so that they can be memory-mapped.
+  '''
+  if os.environ.get('TNS_FORMAT') == 'bin' and fname.endswith('.tns'):
+    fname = fname[:-len('.tns')] + '.bin'
+  if fname.endswith('.bin'):
+    from bin_tensor import BinaryTensorWriter
+    return BinaryTensorWriter(fname, nmodes, **kwargs)
+  return TensorWriter(compressed_name(fname), nmodes, **kwargs)
+
+
+class TensorWriter:
+  '''
+    Writes the nonzeros of a .tns file in large blocks. Nonzeros are copied
+    into a preallocated flat buffer and every full block is formatted with a
+    single %-format call and written at once, instead of one format and one
+    write per nonzero. Output is byte-for-byte what
+      print('{} {} ... {}'.format(*inds, val), file=fout)
+    produces.
+
+    value_type is only used by the binary writer, and is accepted here so
+    that parsers can pass it to open_tensor() regardless of the format.
+  '''
+
+  def __init__(self, fname, nmodes, block=1 << 16, value_type=None):
+    self.fname = fname
+    self.nmodes = nmodes
+    self.block = block
+    self.width = nmodes + 1
+    self.fout = open_output(fname, 'w')
+
+    self.buf = [0] * (block * self.width)
+    self.pos = 0
+    self.line_fmt = ' '.join(['%s'] * self.width) + '\n'
+    self.block_fmt = self.line_fmt * block
+
+    self.nnz = 0
+    self.start = time.perf_counter()
+    self.elapsed = None
+
+  def write(self, *nnz):
+    '''
+      Buffer one nonzero, given as its nmodes indices followed by its value.
+    '''
+    if len(nnz) != self.width:
+      raise ValueError('expected {} indices and a value, got {} fields'.format(
+          self.nmodes, len(nnz)))
+    p = self.pos
+    self.buf[p:p + self.width] = nnz
+    p += self.width
+    if p == len(self.buf):
+      self.fout.write(self.block_fmt % tuple(self.buf))
+      self.nnz += self.block
+      p = 0
+    self.pos = p
+
+  def write_columns(self, inds, vals):
+    '''
+      Write len(vals) nonzeros, given as one sequence of indices per mode
+      and a sequence of values.
+    '''
+    self._write_buffered()
+    flat = list(chain.from_iterable(zip(*inds, vals)))
+    step = self.block * self.width
+    for start in range(0, len(flat), step):
+      chunk = flat[start:start + step]
+      self.fout.write((self.line_fmt * (len(chunk) // self.width)) %
+          tuple(chunk))
+    self.nnz += len(vals)
+
+  def _write_buffered(self):
+    n = self.pos // self.width
+    if n:
+      self.fout.write((self.line_fmt * n) % tuple(self.buf[:self.pos]))
+      self.nnz += n
+      self.pos = 0
+
+  def flush(self):
+    self._write_buffered()
+    self.fout.flush()
+
+  def close(self):
+    if self.fout.closed:
+      return
+    self.flush()
+    self.fout.close()
+    self.elapsed = time.perf_counter() - self.start
+
+  def count(self):
+    '''
+      Nonzeros written so far, including buffered ones.
+    '''
+    return self.nnz + self.pos // self.width
+
+  def rate(self):
+    '''
+      Nonzeros written per second since the writer was opened.
+    '''
+    elapsed = self.elapsed
+    if elapsed is None:
+      elapsed = time.perf_counter() - self.start
+    return self.count() / max(elapsed, 1e-9)
+
+  def report(self):
+    return '{}: {:,d} nnz ({:,.0f} nnz/s)'.format(self.fname, self.count(),
+        self.rate())
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
@@ -0,0 +1,301 @@
+
+##############################################################################
+# Parallel .tns reader.
+#
+# The file is memory-mapped and cut into newline-aligned byte ranges, and a
+# pool of worker processes parses each range into NumPy arrays: an
+# (nnz x nmodes) int64 array of indices and an array of values. Comment
+# ("#") and blank lines are skipped. Binary tensors (see bin_tensor.py) are
+# read through the same interface, straight from their mapped columns.
+#
+#   with TnsReader('tensor.tns') as reader:
+#     for inds, vals in reader.chunks():
+#       ...
+#
+# Values are kept as strings by default (values='str'), so that they can be
+# written back unchanged; values='d' or 'q' parses them as float64 or int64.
+##############################################################################
+
+import os
+import mmap
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from bin_tensor import BinaryTensor, is_binary
+
+
+def read_range(fname, start, length):
+  '''
+    Return bytes [start, start + length) of fname, through a memory map.
+  '''
+  if length == 0:
+    return b''
+  with open(fname, 'rb') as fin:
+    with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      return mm[start:start + length]
+
+
+def chunk_ranges(fname, chunk_bytes=1 << 24):
+  '''
+    Split a file into (start, length) byte ranges of about chunk_bytes which
+    end on line boundaries.
+  '''
+  size = os.path.getsize(fname)
+  if size == 0:
+    return []
+  ranges = []
+  with open(fname, 'rb') as fin:
+    with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      start = 0
+      while start < size:
+        end = mm.find(b'\n', min(start + chunk_bytes, size) - 1)
+        end = size if end < 0 else end + 1
+        ranges.append((start, end - start))
+        start = end
+  return ranges
+
+
+def count_modes(fname):
+  '''
+    The number of modes of a tensor, from its first non-comment line.
+  '''
+  if is_binary(fname):
+    with BinaryTensor(fname) as tt:
+      return tt.nmodes
+  with open(fname, 'r') as fin:
+    for line in fin:
+      if line[0] != '#' and line.strip():
+        return len(line.split()) - 1
+  return 0
+
+
+def _tokens(data, nmodes):
+  text = data.decode()
+  if '#' in text:
+    text = '\n'.join(line for line in text.splitlines() if line[:1] != '#')
+  tokens = text.split()
+  if len(tokens) % (nmodes + 1):
+    raise ValueError('found lines without {} indices and a value'.format(
+        nmodes))
+  return tokens
+
+
+def parse_range(fname, start, length, nmodes, values='str'):
+  '''
+    Parse a byte range of a .tns file into (inds, vals) arrays.
+  '''
+  tokens = _tokens(read_range(fname, start, length), nmodes)
+  tokens = np.array(tokens, dtype=str).reshape(-1, nmodes + 1)
+  inds = tokens[:, :nmodes].astype(np.int64)
+  vals = tokens[:, nmodes]
+  if values != 'str':
+    vals = vals.astype(np.dtype(values))
+  return inds, vals
+
+
+def _parse_job(job):
+  fname, start, length, nmodes, values, func = job
+  inds, vals = parse_range(fname, start, length, nmodes, values)
+  if func is not None:
+    return func(inds, vals)
+  return inds, vals
+
+
+def _count_job(job):
+  fname, start, length, nmodes = job
+  return len(_tokens(read_range(fname, start, length), nmodes)) // (nmodes + 1)
+
+
+@contextlib.contextmanager
+def _attached(name):
+  '''
+    Map the shared memory the parent created, as a buffer. Only the parent
+    registers it with the resource tracker and unlinks it.
+  '''
+  try:
+    shm = shared_memory.SharedMemory(name, track=False)
+  except TypeError:
+    # Before Python 3.13, attaching registers the segment with the resource
+    # tracker, which forked workers share with the parent. Map it directly
+    # instead, so that the tracker is never touched.
+    import _posixshmem
+    fd = _posixshmem.shm_open('/' + name, os.O_RDWR, mode=0o600)
+    try:
+      mm = mmap.mmap(fd, os.fstat(fd).st_size)
+    finally:
+      os.close(fd)
+    try:
+      yield mm
+    finally:
+      mm.close()
+    return
+  try:
+    yield shm.buf
+  finally:
+    shm.close()
+
+
+def _fill_job(job):
+  '''
+    Parse a range straight into the shared index (and value) arrays, at
+    row offset.
+  '''
+  fname, start, length, nmodes, values, offset, nnz, names = job
+  inds, vals = parse_range(fname, start, length, nmodes, values)
+  n = len(vals)
+
+  with _attached(names[0]) as buf:
+    shared = np.ndarray((nnz, nmodes), np.int64, buffer=buf)
+    shared[offset:offset + n] = inds
+    del shared
+  if values == 'str':
+    return vals
+
+  with _attached(names[1]) as buf:
+    shared = np.ndarray((nnz,), np.dtype(values), buffer=buf)
+    shared[offset:offset + n] = vals
+    del shared
+  return None
+
+
+class TnsReader:
+  '''
+    Reads a .tns (or binary) tensor in chunks parsed by worker processes.
+
+    chunks() yields (inds, vals) for each chunk, in file order. map(func)
+    instead yields func(inds, vals), computed in the workers, so only the
+    results are sent back; func must be a module-level function. read_all()
+    parses the whole tensor into arrays in shared memory, which the workers
+    fill in place; they remain valid until close().
+  '''
+
+  def __init__(self, fname, nmodes=None, workers=None, chunk_bytes=1 << 24,
+      values='str'):
+    self.fname = fname
+    self.binary = is_binary(fname)
+    self.nmodes = nmodes or count_modes(fname)
+    self.workers = workers or os.cpu_count() or 1
+    self.chunk_bytes = chunk_bytes
+    self.values = values
+
+    self.value_type = 'd' if values == 'str' else values
+    if self.binary:
+      with BinaryTensor(fname) as tt:
+        self.value_type = tt.value_type
+
+    self._pool = None
+    self._shm = []
+
+  def _pooled(self, jobs):
+    return self.workers > 1 and len(jobs) > 1
+
+  def _map(self, func, jobs):
+    '''
+      Apply func to each job in order, in the pool if there is more than one
+      worker and job.
+    '''
+    if not self._pooled(jobs):
+      return map(func, jobs)
+    if self._pool is None:
+      self._pool = multiprocessing.Pool(self.workers)
+    return self._pool.imap(func, jobs)
+
+  def ranges(self):
+    return chunk_ranges(self.fname, self.chunk_bytes)
+
+  def _binary_chunks(self):
+    with BinaryTensor(self.fname) as tt:
+      cols, vals = tt.arrays()
+      step = max(self.chunk_bytes // 8, 1)
+      for start in range(0, tt.nnz, step):
+        inds = np.empty((min(step, tt.nnz - start), self.nmodes), np.int64)
+        for m in range(self.nmodes):
+          inds[:, m] = cols[m][start:start + step]
+        yield inds, np.array(vals[start:start + step])
+      del cols, vals
+
+  def chunks(self):
+    '''
+      Yield (inds, vals) for each chunk of the tensor.
+    '''
+    if self.binary:
+      yield from self._binary_chunks()
+      return
+    jobs = [(self.fname, start, length, self.nmodes, self.values, None)
+        for start, length in self.ranges()]
+    yield from self._map(_parse_job, jobs)
+
+  def map(self, func):
+    '''
+      Yield func(inds, vals) for each chunk of the tensor.
+    '''
+    if self.binary:
+      for inds, vals in self._binary_chunks():
+        yield func(inds, vals)
+      return
+    jobs = [(self.fname, start, length, self.nmodes, self.values, func)
+        for start, length in self.ranges()]
+    yield from self._map(_parse_job, jobs)
+
+  def _shared_array(self, shape, dtype):
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    self._shm.append(shm)
+    return shm.name, np.ndarray(shape, dtype, buffer=shm.buf)
+
+  def read_all(self):
+    '''
+      Return (inds, vals) for the whole tensor. With a pool, text is parsed
+      in two passes: the first counts the non-zeros of each range, and the
+      second writes each range into its slice of the shared arrays. Values
+      kept as strings are gathered from the workers instead.
+    '''
+    ranges = [] if self.binary else self.ranges()
+    if not self._pooled(ranges):
+      chunks = list(self.chunks())
+      if not chunks:
+        vtype = str if self.values == 'str' else np.dtype(self.value_type)
+        return np.empty((0, self.nmodes), np.int64), np.empty(0, vtype)
+      return (np.concatenate([c[0] for c in chunks]),
+          np.concatenate([c[1] for c in chunks]))
+
+    counts = list(self._map(_count_job,
+        [(self.fname, start, length, self.nmodes) for start, length in ranges]))
+    nnz = sum(counts)
+    offsets = np.cumsum([0] + counts[:-1]).tolist()
+
+    ind_name, inds = self._shared_array((nnz, self.nmodes), np.int64)
+    val_name, vals = None, None
+    if self.values != 'str':
+      val_name, vals = self._shared_array((nnz,), np.dtype(self.values))
+
+    jobs = [(self.fname, start, length, self.nmodes, self.values, offset, nnz,
+        (ind_name, val_name))
+        for (start, length), offset in zip(ranges, offsets)]
+    results = list(self._map(_fill_job, jobs))
+    if self.values == 'str':
+      vals = np.concatenate(results) if results else np.empty(0, dtype=str)
+    return inds, vals
+
+  def close(self):
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+    for shm in self._shm:
+      try:
+        shm.close()
+      except BufferError:
+        # arrays still refer to it; the mapping goes away with them
+        pass
+      shm.unlink()
+    self._shm = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()